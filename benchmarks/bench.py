@@ -0,0 +1,219 @@
+"""
+Measures the throughput of training, encoding and decoding with the tokenizers.
+Run from the root of the repo as:
+
+python benchmarks/bench.py --output results.json
+
+The text is a synthetic corpus of a given size, mixing English, CJK, code,
+emoji and long runs of whitespace in given proportions (--mix), and generated
+from a fixed seed, so that runs on different commits see the same text. Every
+measurement is the best of a few repeats, and the peak memory is measured in
+one more (slower) run under tracemalloc. The results can be written to a JSON
+file, and compared against an earlier one with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from minbpe import BasicTokenizer, RegexTokenizer, GPT4Tokenizer
+
+# -----------------------------------------------------------------------------
+# synthetic corpora
+
+ENGLISH_WORDS = """the of and to in is was for that it with as he on be at by his this had not
+are but from or have an they which one you were her all she there would their we him been has when
+who will more no if out so said what up its about into than them can only other new some could time
+these two may then do first any my now such like our over man me even most made after also did many
+before must through back years where much your way well down should because each just those people
+how too little state good very make world still own see men work long get here between both life being
+under never day same another know while last might us great old year off come since against go came
+right used take three""".split()
+PUNCTUATION = [",", ",", ".", ".", ".", "!", "?", ";", ":", "'s", "'ll", " -", " (", ")"]
+CJK_RANGES = [(0x4E00, 0x9FFF), (0x3040, 0x309F), (0x30A0, 0x30FF), (0xAC00, 0xD7A3)]
+CJK_PUNCTUATION = ["。", "，", "、", "？", "！", "「", "」"]
+CODE_TEMPLATES = [
+    "def {a}({b}, {c}=None):\n    {d} = {b}.{e}({c})\n    return {d}\n",
+    "for {a} in range({n}):\n    if {a} % {m} == 0:\n        {b}.append({a} ** 2)\n",
+    "class {A}({B}):\n    def __init__(self, {a}):\n        self.{a} = {a}\n",
+    "{a} = {{'{b}': {n}, '{c}': [{m}, {n}]}}  # {d} {e}\n",
+    "if ({a} != {b} && {c}[{n}] >= {m}) {{\n\t{d}->{e}({n});\n}}\n",
+]
+IDENTIFIERS = ["x", "i", "idx", "data", "result", "self_ptr", "tokens", "value", "buffer", "count", "node"]
+EMOJI_RANGES = [(0x1F300, 0x1F5FF), (0x1F600, 0x1F64F), (0x1F680, 0x1F6FF), (0x1F900, 0x1F9FF)]
+SKIN_TONES = [chr(c) for c in range(0x1F3FB, 0x1F400)]
+
+def english(rng):
+    words = [rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(8, 30))]
+    words[0] = words[0].capitalize()
+    for i in rng.sample(range(len(words)), len(words) // 6):
+        words[i] += rng.choice(PUNCTUATION)
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), str(rng.randint(0, 100000)))
+    return " ".join(words) + rng.choice([". ", ".\n", "!\n\n", "? "])
+
+def cjk(rng):
+    lo, hi = rng.choice(CJK_RANGES)
+    chars = [chr(rng.randint(lo, hi)) for _ in range(rng.randint(10, 60))]
+    for i in rng.sample(range(len(chars)), len(chars) // 8):
+        chars[i] = rng.choice(CJK_PUNCTUATION)
+    return "".join(chars) + "\n"
+
+def code(rng):
+    template = rng.choice(CODE_TEMPLATES)
+    names = {k: rng.choice(IDENTIFIERS) for k in "abcde"}
+    names.update({k: rng.choice(IDENTIFIERS).capitalize() for k in "AB"})
+    return template.format(n=rng.randint(0, 1000), m=rng.randint(1, 16), **names)
+
+def emoji(rng):
+    out = []
+    for _ in range(rng.randint(1, 12)):
+        lo, hi = rng.choice(EMOJI_RANGES)
+        e = chr(rng.randint(lo, hi))
+        if rng.random() < 0.2:
+            e += rng.choice(SKIN_TONES)
+        if rng.random() < 0.1:
+            e += "‍" + chr(rng.randint(lo, hi)) # zero width joiner sequence
+        out.append(e)
+    return "".join(out) + rng.choice([" ", "\n", ""])
+
+def whitespace(rng):
+    return "".join(rng.choice([" ", " ", "\t", "\n", "\r\n"]) for _ in range(rng.randint(20, 200)))
+
+GENERATORS = {"english": english, "cjk": cjk, "code": code, "emoji": emoji, "whitespace": whitespace}
+DEFAULT_MIX = "english=0.6,code=0.2,cjk=0.1,emoji=0.05,whitespace=0.05"
+
+def parse_mix(mix):
+    # "english=0.6,code=0.4" -> {"english": 0.6, "code": 0.4}
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in GENERATORS:
+            raise ValueError(f"unknown corpus kind {name!r}, choose from {', '.join(GENERATORS)}")
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+def make_corpus(size, mix, seed=1337):
+    """A synthetic text of about size UTF-8 bytes, mixing the kinds of text in mix"""
+    rng = random.Random(seed)
+    names, weights = zip(*parse_mix(mix).items())
+    pieces, num_bytes = [], 0
+    while num_bytes < size:
+        piece = GENERATORS[rng.choices(names, weights)[0]](rng)
+        pieces.append(piece)
+        num_bytes += len(piece.encode("utf-8"))
+    return "".join(pieces)
+
+# -----------------------------------------------------------------------------
+# measurements
+
+def measure(fn, repeats, memory):
+    # the best wall time of fn() over repeats, its result, and the peak memory
+    # (in bytes) of one more run under tracemalloc (which slows things down)
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, result, peak
+
+def bench_tokenizer(name, tokenizer, train_text, text, args):
+    results = []
+    def record(task, seconds, peak, **rates):
+        result = dict(tokenizer=name, task=task, seconds=seconds, **rates,
+                      peak_memory_mb=None if peak is None else peak / 1e6)
+        results.append(result)
+        rates = ", ".join(f"{k} {v:,.2f}" for k, v in rates.items())
+        memory = "" if peak is None else f", peak memory {peak / 1e6:.1f} MB"
+        print(f"{name:>6} {task:<7} {seconds:8.3f}s  {rates}{memory}")
+    if train_text is not None:
+        num_merges = args.vocab_size - 256
+        def train():
+            tokenizer.train(train_text, args.vocab_size)
+        seconds, _, peak = measure(train, args.repeats, args.memory)
+        record("train", seconds, peak, merges_per_s=num_merges / seconds,
+               mb_per_s=len(train_text.encode("utf-8")) / 1e6 / seconds)
+    num_bytes = len(text.encode("utf-8"))
+    seconds, ids, peak = measure(lambda: tokenizer.encode(text), args.repeats, args.memory)
+    record("encode", seconds, peak, mb_per_s=num_bytes / 1e6 / seconds, tokens_per_s=len(ids) / seconds)
+    seconds, decoded, peak = measure(lambda: tokenizer.decode(ids), args.repeats, args.memory)
+    assert decoded == text
+    record("decode", seconds, peak, mb_per_s=num_bytes / 1e6 / seconds, tokens_per_s=len(ids) / seconds)
+    return results
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    # print how much faster (> 1) or slower (< 1) every measurement got
+    print(f"\ncompared to {baseline['commit']}:")
+    old = {(r["tokenizer"], r["task"]): r for r in baseline["results"]}
+    for r in results:
+        b = old.get((r["tokenizer"], r["task"]))
+        if b is None:
+            continue
+        change = b["seconds"] / r["seconds"]
+        flag = "  <-- slower" if change < 0.9 else ""
+        print(f"{r['tokenizer']:>6} {r['task']:<7} {change:6.2f}x{flag}")
+
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=1_000_000, help="bytes of text to encode and decode")
+    parser.add_argument("--train-size", type=int, default=50_000, help="bytes of text to train on")
+    parser.add_argument("--vocab-size", type=int, default=512, help="vocab size to train to")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"kinds of text and their weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--seed", type=int, default=1337, help="seed of the synthetic corpus")
+    parser.add_argument("--tokenizers", default="basic,regex,gpt4", help="which tokenizers to measure")
+    parser.add_argument("--gpt4-ranks", default=None, help="a local cl100k_base.tiktoken file (default: use tiktoken)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per measurement, the best one counts")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip measuring the peak memory")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="a JSON file of earlier results to compare to")
+    args = parser.parse_args()
+
+    text = make_corpus(args.size, args.mix, args.seed)
+    train_text = make_corpus(args.train_size, args.mix, args.seed + 1)
+    print(f"corpus: {len(text.encode('utf-8')) / 1e6:.2f} MB ({args.mix}), training on {len(train_text.encode('utf-8')) / 1e6:.2f} MB")
+    results = []
+    for name in args.tokenizers.split(","):
+        if name == "basic":
+            results += bench_tokenizer(name, BasicTokenizer(), train_text, text, args)
+        elif name == "regex":
+            results += bench_tokenizer(name, RegexTokenizer(), train_text, text, args)
+        elif name == "gpt4":
+            try:
+                tokenizer = GPT4Tokenizer(ranks_file=args.gpt4_ranks)
+            except Exception as e: # no tiktoken, no network, ...
+                print(f"  gpt4 skipped ({type(e).__name__}), pass --gpt4-ranks to use a local ranks file")
+                continue
+            results += bench_tokenizer(name, tokenizer, None, text, args)
+        else:
+            raise ValueError(f"unknown tokenizer {name!r}")
+
+    report = dict(commit=git_commit(), python=platform.python_version(), platform=platform.platform(),
+                  settings=vars(args), results=results)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
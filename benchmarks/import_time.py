@@ -0,0 +1,44 @@
+"""
+Measures how long it takes to import minbpe, in fresh Python processes.
+Run from the root of the repo as:
+
+python benchmarks/import_time.py
+
+Every statement is timed in a new interpreter, a number of times, and we
+report the median, minus the time to start up an interpreter that does nothing.
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+STATEMENTS = [
+    "import minbpe",
+    "from minbpe import BasicTokenizer",
+    "from minbpe import RegexTokenizer",
+    "from minbpe import RegexTokenizer; RegexTokenizer()",
+    "from minbpe import GPT4Tokenizer",
+]
+
+def time_statement(statement, repeats, cwd):
+    # the wall time of a python process running statement, in seconds
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, cwd=cwd)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=20, help="processes to start per statement")
+    args = parser.parse_args()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    baseline = time_statement("pass", args.repeats, root)
+    print(f"python startup: {baseline * 1000:.1f}ms")
+    for statement in STATEMENTS:
+        t = time_statement(statement, args.repeats, root)
+        print(f"{(t - baseline) * 1000:7.1f}ms  {statement}")
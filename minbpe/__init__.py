@@ -1,5 +1,30 @@
-from .base import Tokenizer
-from .basic import BasicTokenizer
-from .regex import RegexTokenizer
-from .gpt4 import GPT4Tokenizer
-from .utilities import render_tokens
+"""
+The tokenizers are imported lazily, when they are first used: this keeps
+`import minbpe` cheap, and e.g. `from minbpe import RegexTokenizer` never
+imports anything that only the GPT4Tokenizer needs.
+"""
+
+import importlib
+
+# the public names of the package, and the submodules they are defined in
+_exports = {
+    "Tokenizer": ".base",
+    "BasicTokenizer": ".basic",
+    "RegexTokenizer": ".regex",
+    "GPT4Tokenizer": ".gpt4",
+    "StreamingDecoder": ".base",
+    "render_tokens": ".utilities",
+}
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value # so that we only get here the first time
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
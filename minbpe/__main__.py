@@ -0,0 +1,39 @@
+"""
+Command line tools, run as python -m minbpe. For now there's one:
+
+    python -m minbpe encode MODEL -o OUTPUT_DIR INPUT [INPUT ...]
+
+which encodes text and JSONL files into binary token shards, see shards.py.
+Run again with the same arguments to resume an interrupted run.
+"""
+
+import argparse
+
+from .shards import encode_corpus
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m minbpe")
+    commands = parser.add_subparsers(dest="command", required=True)
+    encode = commands.add_parser("encode", help="encode text and JSONL files into binary token shards")
+    encode.add_argument("model", help="the tokenizer, a .model or .mbpe file")
+    encode.add_argument("inputs", nargs="+", help="text files, or JSONL files (.jsonl, .json)")
+    encode.add_argument("-o", "--output-dir", required=True, help="where to write the shards and index.json")
+    encode.add_argument("--shard-size", type=int, default=10**8, help="tokens per shard (default: 100M)")
+    encode.add_argument("--num-workers", type=int, default=None, help="encoding processes (default: one per CPU)")
+    encode.add_argument("--text-key", default="text", help="the key of the text in JSONL documents")
+    encode.add_argument("--append-special", default=None, metavar="TOKEN",
+                        help="a special token to append to every document, e.g. '<|endoftext|>'")
+    encode.add_argument("--block-size", type=int, default=1 << 20, help="characters per block of text files")
+    encode.add_argument("-q", "--quiet", action="store_true", help="don't show the progress")
+    args = parser.parse_args(argv)
+
+    if args.command == "encode":
+        encode_corpus(args.model, args.inputs, args.output_dir, shard_size=args.shard_size,
+                      num_workers=args.num_workers, text_key=args.text_key,
+                      append_special=args.append_special, block_size=args.block_size,
+                      verbose=not args.quiet)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,15 @@ It would be possible to be a lot more strict about the interface and
 e.g. isolating all regex/pattern parts to the RegexTokenizer, but
 some concessions are made for simplicity.
 """
+import os
+import heapq
+import codecs
+import functools
+import threading
+import itertools
 import unicodedata
+from array import array
+from collections import Counter, OrderedDict
 
 # -----------------------------------------------------------------------------
 # a few helper functions useful for both BasicTokenizer and RegexTokenizer
@@ -22,6 +30,76 @@ def get_stats(ids, counts=None):
     return counts
 
 
+# get_stats_batch uses numpy (if installed) for at least this many ids
+NUMPY_MIN_IDS = 1 << 16
+
+def get_stats_batch(seqs, weights=None, backend="auto"):
+    """
+    Count the consecutive pairs in many sequences of ids at once, e.g. all the
+    chunks of a text, optionally with a weight (an int count) per sequence.
+    Returns a Counter of pair -> count, with the pairs in the order they first
+    appear, like get_stats would (which matters for breaking ties).
+    Example: [[1, 2, 3], [1, 2]], weights=[1, 10] -> {(1, 2): 11, (2, 3): 1}
+    - backend: "python", "numpy", or "auto" to use numpy if it is installed
+      and there are enough ids to be worth it
+    """
+    seqs = seqs if isinstance(seqs, list) else list(seqs)
+    if backend == "auto":
+        backend = "python"
+        if sum(map(len, seqs)) >= NUMPY_MIN_IDS:
+            try:
+                import numpy
+                backend = "numpy"
+            except ImportError:
+                pass
+    if backend == "numpy":
+        return _get_stats_batch_numpy(seqs, weights)
+    elif backend != "python":
+        raise ValueError(f"backend={backend} not understood")
+    if weights is not None:
+        counts = Counter()
+        for ids, weight in zip(seqs, weights):
+            for pair in zip(ids, ids[1:]):
+                counts[pair] += weight
+        return counts
+    # join all the sequences, with a -1 in between, and count all the pairs in
+    # one go (which Counter does in C), then drop the pairs across sequences
+    flat = []
+    for ids in seqs:
+        flat += ids
+        flat.append(-1)
+    counts = Counter(zip(flat, flat[1:]))
+    for pair in [pair for pair in counts if pair[0] == -1 or pair[1] == -1]:
+        del counts[pair]
+    return counts
+
+def _get_stats_batch_numpy(seqs, weights):
+    import numpy as np
+    lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+    flat = np.fromiter(itertools.chain.from_iterable(seqs), dtype=np.int64, count=int(lengths.sum()))
+    # pack every pair into one 64-bit key, and drop the pairs across sequences
+    keys = (flat[:-1] << 32) | flat[1:]
+    ends = np.cumsum(lengths)[:-1]
+    inside = np.ones(len(keys), dtype=bool)
+    inside[ends[(ends > 0) & (ends <= len(keys))] - 1] = False
+    pair_weights = np.repeat(np.ones(len(seqs), dtype=np.int64) if weights is None
+                             else np.asarray(weights, dtype=np.int64), lengths)[:-1][inside]
+    keys = keys[inside]
+    if len(keys) == 0:
+        return Counter()
+    # sort the keys (stably, so the first of every key is its first occurrence)
+    # and add up the weights of every run of the same key
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    sums = np.add.reduceat(pair_weights[order], starts)
+    # and put them back in the order of first occurrence
+    by_first = np.argsort(order[starts])
+    unique = sorted_keys[starts][by_first]
+    pairs = zip((unique >> 32).tolist(), (unique & 0xFFFFFFFF).tolist())
+    return Counter(dict(zip(pairs, sums[by_first].tolist())))
+
+
 def merge(ids, pair, idx):
     """
     In the list of integers (ids), replace all consecutive occurrences
@@ -40,6 +118,159 @@ def merge(ids, pair, idx):
             i += 1
     return newids
 
+def apply_merges(ids, merges):
+    """
+    Encode the list of integers (ids) with the merges ((int, int) -> int),
+    giving the same result as repeatedly merging all occurrences of the pair
+    with the lowest merge index, until no pair can be merged anymore.
+    Example: ids=[97, 97, 97], merges={(97, 97): 256} -> [256, 97]
+    Doing that literally, with get_stats and merge, is O(n^2) in the length of
+    ids. Instead, we keep the tokens in a doubly linked list, and all the pairs
+    that could be merged in a heap ordered by (merge index, position). Then we
+    merge one pair at a time, in place, in O(n log n).
+    """
+    n = len(ids)
+    if n < 2:
+        return list(ids)
+    ids = list(ids)
+    # the linked list: the positions of the next and previous token that is
+    # still alive. a token that was merged into its left neighbor becomes None
+    nxt = list(range(1, n + 1))
+    prv = list(range(-1, n - 1))
+    heap = []
+    for i in range(n - 1):
+        idx = merges.get((ids[i], ids[i + 1]))
+        if idx is not None:
+            heap.append((idx, i))
+    heapq.heapify(heap)
+    while heap:
+        idx, i = heapq.heappop(heap)
+        j = nxt[i]
+        # skip heap entries for pairs that have been changed by a merge since.
+        # merge indices are unique, so checking the index checks the pair
+        if ids[i] is None or j == n or merges.get((ids[i], ids[j])) != idx:
+            continue
+        # merge the pair (i, j) into position i
+        ids[i] = idx
+        ids[j] = None
+        k = nxt[j]
+        nxt[i] = k
+        if k < n:
+            prv[k] = i
+        # the merge created up to two new pairs with the neighbors. they contain
+        # the token we just minted, so their merge index can only be higher,
+        # which means that they're merged after all the current occurrences
+        if prv[i] >= 0:
+            new_idx = merges.get((ids[prv[i]], idx))
+            if new_idx is not None:
+                heapq.heappush(heap, (new_idx, prv[i]))
+        if k < n:
+            new_idx = merges.get((idx, ids[k]))
+            if new_idx is not None:
+                heapq.heappush(heap, (new_idx, i))
+    return [idx for idx in ids if idx is not None]
+
+def _is_valid_token_pair(merges, split, token1, token2, limit):
+    # can the tokens token1 and token2 end up next to each other, when encoding
+    # their bytes? that is, does no merge across the boundary between them happen
+    # while they are being built? we undo their merges (split) in reverse order,
+    # and check every pair of tokens at the boundary on the way: it must not be
+    # merged before one of the two is merged further. limit is the merge index
+    # that a pair at the boundary has to stay below. this is is_valid_token_pair
+    # of the bpe crate: https://github.com/github/rust-gems/tree/main/crates/bpe
+    while True:
+        combined = merges.get((token1, token2))
+        if combined is not None and combined < limit:
+            return False
+        if token1 > token2:
+            # token1 is the most recent merge, undo it. at a tie on the merge
+            # index, the pair to the left goes first, so it wins over ours
+            limit = token1
+            token1 = split.get(token1, (token1, token1))[1]
+            if token1 == limit:
+                limit = token2 + 1
+                token2 = split.get(token2, (token2, token2))[0]
+                if token2 + 1 == limit:
+                    return True # both are single bytes
+        else:
+            # at a tie with the merge that made token2, our pair is to the left
+            # of it, so it wins: the limit includes token2 itself
+            limit = token2 + 1
+            token2 = split.get(token2, (token2, token2))[0]
+            if token2 + 1 == limit:
+                limit = token1
+                token1 = split.get(token1, (token1, token1))[1]
+                if token1 == limit:
+                    return True
+
+def reachable_tokens(merges):
+    """
+    Return the set of tokens that apply_merges() encodes their own bytes to,
+    i.e. the tokens t for which apply_merges(bytes of t, merges) == [t]. Not all
+    of them are: e.g. with merges {(98, 99): 256, (97, 98): 257, (257, 99): 258},
+    "abc" is encoded as [97, 256] and not as [258]. A token made of the pair
+    (p0, p1) is reachable if p0 and p1 are, and no merge across the boundary
+    between them gets in the way, which takes a handful of steps to check
+    instead of encoding all of its bytes.
+    """
+    split = {idx: pair for pair, idx in merges.items()}
+    reachable = set(range(256))
+    for idx in sorted(split):
+        p0, p1 = split[idx]
+        # (the pair (p0, p1) itself is merged at idx, so the limit starts there)
+        if p0 in reachable and p1 in reachable and _is_valid_token_pair(merges, split, p0, p1, idx):
+            reachable.add(idx)
+    return reachable
+
+class LRUCache:
+    """
+    A bounded, thread-safe cache that evicts the least recently used entry,
+    and counts its hits and misses. Used to remember the encodings of chunks.
+    """
+
+    def __init__(self, maxsize):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # return the value for key, or None if it is not in the cache
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        # locks can't be pickled, e.g. when the tokenizer is sent to worker
+        # processes. the workers simply start out with an empty cache
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
 # first two helper functions...
 def replace_control_characters(s: str) -> str:
     # we don't want to print control characters
@@ -60,6 +291,74 @@ def render_token(t: bytes) -> str:
     s = replace_control_characters(s)
     return s
 
+class StreamingDecoder:
+    """
+    Decodes token ids one at a time, e.g. as a model generates them, and returns
+    only the newly completed text every time. A token can end in the middle of
+    a multi-byte UTF-8 character, and simply decoding its bytes would give a
+    replacement character �. Instead, such incomplete tails are held back until
+    the following tokens complete them. In total, the pieces add up to exactly
+    tokenizer.decode(ids), but without re-decoding everything on every step.
+    Example:
+        decoder = StreamingDecoder(tokenizer)
+        for idx in generated_ids:
+            print(decoder.add(idx), end="", flush=True)
+        print(decoder.flush())
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def add(self, idx):
+        """Decode one more token id, returns the new text (possibly empty)"""
+        return self._decoder.decode(self.tokenizer.decode_bytes([idx]))
+
+    def flush(self):
+        """End of the stream: returns whatever is still held back (as �)"""
+        text = self._decoder.decode(b"", final=True)
+        self._decoder.reset()
+        return text
+
+# -----------------------------------------------------------------------------
+# worker processes for encode_batch/decode_batch with the "process" backend.
+# the tokenizer is sent to every worker only once, when the pool starts up,
+# and not along with every single text
+
+_worker_tokenizer = None
+
+def _init_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+def _encode_worker(text, kwargs):
+    return _worker_tokenizer.encode(text, **kwargs)
+
+def _decode_worker(ids):
+    return _worker_tokenizer.decode(ids)
+
+def _encode_array_worker(texts, kwargs):
+    return [_worker_tokenizer.encode_array(text, **kwargs) for text in texts]
+
+def _map_in_pool(tokenizer, fn, worker_fn, items, num_workers, backend):
+    # apply fn (a method of tokenizer) to every item in a pool, keeping the order
+    # (concurrent.futures pulls in multiprocessing, so we only import it when needed)
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    items = list(items)
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    if backend == "thread":
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(fn, items))
+    elif backend == "process":
+        # hand out the items in batches, to keep the overhead of the pool low
+        chunksize = max(1, len(items) // (4 * num_workers))
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(tokenizer,)) as executor:
+            return list(executor.map(worker_fn, items, chunksize=chunksize))
+    else:
+        raise ValueError(f"backend={backend} not understood")
+
 # -----------------------------------------------------------------------------
 # the base Tokenizer class
 
@@ -72,6 +371,27 @@ class Tokenizer:
         self.pattern = "" # str
         self.special_tokens = {} # str -> int, e.g. {'<|endoftext|>': 100257}
         self.vocab = self._build_vocab() # int -> bytes
+        self.stats = None # TokenizerStats, if enabled
+
+    def __getstate__(self):
+        # the stats (and their callback) stay with this tokenizer, and are not
+        # sent along to e.g. the worker processes of encode_batch
+        state = self.__dict__.copy()
+        state["stats"] = None
+        return state
+
+    def enable_stats(self, callback=None):
+        """
+        Start recording timings and counters of every encode and decode call,
+        see stats.py. callback(call) is called after every call, if given.
+        Returns the TokenizerStats.
+        """
+        from .stats import TokenizerStats
+        self.stats = TokenizerStats(callback)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
 
     def train(self, text, vocab_size, verbose=False):
         # Tokenizer can train a vocabulary of size vocab_size from text
@@ -85,6 +405,74 @@ class Tokenizer:
         # Tokenizer can decode a list of integers into a string
         raise NotImplementedError
 
+    def decode_bytes(self, ids):
+        # Tokenizer can decode a list of integers into the raw bytes
+        raise NotImplementedError
+
+    def _encode_into(self, ids, text, **kwargs):
+        # append the encoding of text to ids, a list or e.g. an array.array.
+        # subclasses can override this to avoid building an intermediate list
+        ids.extend(self.encode(text, **kwargs))
+
+    def token_typecode(self):
+        """The array typecode that fits every token id: "H" (uint16) or "I" (uint32)"""
+        max_id = max(max(self.vocab, default=0), max(self.special_tokens.values(), default=0))
+        return "H" if max_id < 1 << 16 else "I"
+
+    def encode_array(self, text, typecode=None, **kwargs):
+        """
+        Like encode, but returns the ids in a compact array.array, of 2 or 4
+        bytes per token (see token_typecode) instead of a list of Python ints.
+        The keyword arguments are passed on to encode.
+        """
+        ids = array(self.token_typecode() if typecode is None else typecode)
+        self._encode_into(ids, text, **kwargs)
+        return ids
+
+    def encode_numpy(self, text, dtype=None, **kwargs):
+        """
+        Like encode_array, but returns a numpy array (which shares its memory
+        with the array.array). The default dtype is uint16 or uint32, whichever
+        fits every token id.
+        """
+        import numpy as np
+        typecode = self.token_typecode() if dtype is None else np.dtype(dtype).char
+        return np.frombuffer(self.encode_array(text, typecode=typecode, **kwargs), dtype=typecode)
+
+    def encode_into(self, text, out, **kwargs):
+        """
+        Encode text into the preallocated 1-d buffer out, e.g. a numpy array or
+        an array.array of unsigned integers, starting at its beginning. Returns
+        the number of tokens written, raises ValueError if they don't fit.
+        """
+        view = memoryview(out)
+        if view.ndim != 1 or view.format not in ("B", "H", "I", "L", "Q"):
+            raise ValueError(f"out must be a 1-d buffer of unsigned integers, not {view.format!r}")
+        # encoded in the same format as out, so that it's copied in one go
+        ids = self.encode_array(text, typecode=view.format, **kwargs)
+        if len(ids) > len(view):
+            raise ValueError(f"out has room for {len(view)} tokens, but the text encodes to {len(ids)}")
+        view[:len(ids)] = memoryview(ids)
+        return len(ids)
+
+    def encode_batch(self, texts, num_workers=None, backend="thread", **kwargs):
+        """
+        Encode a list of texts into a list of lists of token ids, in the same
+        order, by spreading the texts over a pool of num_workers workers.
+        - num_workers: defaults to the number of CPUs. 1 encodes serially
+        - backend: "thread" or "process". Note that the encoding is pure Python,
+          so threads share the GIL and won't run any faster than a single one.
+          With "process", every worker gets its own copy of the tokenizer.
+        - kwargs are passed on to encode(), e.g. allowed_special="all"
+        """
+        fn = functools.partial(self.encode, **kwargs)
+        worker_fn = functools.partial(_encode_worker, kwargs=kwargs)
+        return _map_in_pool(self, fn, worker_fn, texts, num_workers, backend)
+
+    def decode_batch(self, batch_ids, num_workers=None, backend="thread"):
+        """The inverse of encode_batch(): decode a list of lists of token ids"""
+        return _map_in_pool(self, self.decode, _decode_worker, batch_ids, num_workers, backend)
+
     def _build_vocab(self):
         # vocab is simply and deterministically derived from merges
         vocab = {idx: bytes([idx]) for idx in range(256)}
@@ -94,26 +482,32 @@ class Tokenizer:
             vocab[idx] = special.encode("utf-8")
         return vocab
 
-    def save(self, file_prefix):
+    def save(self, file_prefix, binary=False):
         """
         Saves two files: file_prefix.vocab and file_prefix.model
         This is inspired (but not equivalent to!) sentencepiece's model saving:
         - model file is the critical one, intended for load()
         - vocab file is just a pretty printed version for human inspection only
+        If binary, the model is written to file_prefix.mbpe instead, in the
+        binary format of minbpe/binary.py, which is much faster to load.
         """
         # write the model: to be used in load() later
-        model_file = file_prefix + ".model"
-        with open(model_file, 'w') as f:
-            # write the version, pattern and merges, that's all that's needed
-            f.write("minbpe v1\n")
-            f.write(f"{self.pattern}\n")
-            # write the special tokens, first the number of them, then each one
-            f.write(f"{len(self.special_tokens)}\n")
-            for special, idx in self.special_tokens.items():
-                f.write(f"{special} {idx}\n")
-            # the merges dict
-            for idx1, idx2 in self.merges:
-                f.write(f"{idx1} {idx2}\n")
+        if binary:
+            from .binary import write_model
+            write_model(file_prefix + ".mbpe", self.pattern, self.special_tokens, self.merges, self.vocab)
+        else:
+            model_file = file_prefix + ".model"
+            with open(model_file, 'w') as f:
+                # write the version, pattern and merges, that's all that's needed
+                f.write("minbpe v1\n")
+                f.write(f"{self.pattern}\n")
+                # write the special tokens, first the number of them, then each one
+                f.write(f"{len(self.special_tokens)}\n")
+                for special, idx in self.special_tokens.items():
+                    f.write(f"{special} {idx}\n")
+                # the merges dict
+                for idx1, idx2 in self.merges:
+                    f.write(f"{idx1} {idx2}\n")
         # write the vocab: for the human to look at
         vocab_file = file_prefix + ".vocab"
         inverted_merges = {idx: pair for pair, idx in self.merges.items()}
@@ -139,6 +533,17 @@ class Tokenizer:
 
     def load(self, model_file):
         """Inverse of save() but only for the model file"""
+        if model_file.endswith(".mbpe"):
+            # the binary format already has the vocab, no need to rebuild it
+            from .binary import read_model
+            model = read_model(model_file)
+            self.pattern = model["pattern"]
+            self.merges = model["merges"]
+            self.special_tokens = model["special_tokens"]
+            self.vocab = model["vocab"]
+            for special, idx in self.special_tokens.items():
+                self.vocab[idx] = special.encode("utf-8")
+            return
         assert model_file.endswith(".model")
         # read the model file
         merges = {}
@@ -9,7 +9,9 @@ But:
 - Does not handle any special tokens.
 """
 
-from .base import Tokenizer, get_stats, merge
+import time
+from .base import Tokenizer, get_stats, merge, apply_merges
+from .stats import instrumented
 
 
 class BasicTokenizer(Tokenizer):
@@ -17,9 +19,15 @@ class BasicTokenizer(Tokenizer):
     def __init__(self):
         super().__init__()
 
-    def train(self, text, vocab_size, verbose=False):
+    def train(self, text, vocab_size, verbose=False, checkpoint=None, checkpoint_every=1000, backend="python"):
+        """
+        - checkpoint: optional path to save the training state to, every
+          checkpoint_every merges and at the end. See resume_training.
+        - backend: "python", or "numpy" to count and merge the pairs with
+          vectorized NumPy operations (see vectorized.py), which is a lot faster
+          on longer texts. Both give exactly the same merges.
+        """
         assert vocab_size >= 256
-        num_merges = vocab_size - 256
 
         # input text preprocessing
         text_bytes = text.encode("utf-8") # raw bytes
@@ -28,21 +36,66 @@ class BasicTokenizer(Tokenizer):
         # iteratively merge the most common pairs to create new tokens
         merges = {} # (int, int) -> int
         vocab = {idx: bytes([idx]) for idx in range(256)} # int -> bytes
-        for i in range(num_merges):
-            # count up the number of times every consecutive pair appears
-            stats = get_stats(ids)
-            # find the pair with the highest count
-            pair = max(stats, key=stats.get)
+        self._train(ids, merges, vocab, vocab_size, verbose, checkpoint, checkpoint_every, backend)
+
+    def resume_training(self, checkpoint_file, vocab_size, verbose=False, checkpoint=None, checkpoint_every=1000,
+                        backend="python"):
+        """
+        Continue the training run saved in checkpoint_file (see train) until the
+        vocab has vocab_size tokens, with the same merges as an uninterrupted
+        run to vocab_size. The new state is saved to checkpoint, by default
+        checkpoint_file itself.
+        """
+        from .checkpoint import read_checkpoint
+        state = read_checkpoint(checkpoint_file)
+        if state["pattern"] or len(state["ids"]) != 1:
+            raise ValueError(f"{checkpoint_file} is not a BasicTokenizer checkpoint")
+        if vocab_size < 256 + len(state["merges"]):
+            raise ValueError(f"the checkpoint already has a vocab of {256 + len(state['merges'])} tokens")
+        checkpoint = checkpoint_file if checkpoint is None else checkpoint
+        self._train(list(state["ids"][0]), state["merges"], state["vocab"], vocab_size, verbose, checkpoint,
+                    checkpoint_every, backend)
+
+    def _train(self, ids, merges, vocab, vocab_size, verbose, checkpoint, checkpoint_every, backend):
+        # merge from the given state (ids after the merges so far) to vocab_size
+        if backend == "python":
+            def most_common_pair(ids, vocab_size):
+                # count up the number of times every consecutive pair appears
+                stats = get_stats(ids)
+                # find the pair with the highest count
+                pair = max(stats, key=stats.get)
+                return pair, stats[pair]
+            merge_pair = merge
+        elif backend == "numpy":
+            # the same, but on an int32 array
+            import numpy as np
+            from .vectorized import most_common_pair, merge as merge_pair
+            ids = np.array(ids, dtype=np.int32)
+        else:
+            raise ValueError(f"backend={backend} not understood")
+        if checkpoint is not None:
+            from .checkpoint import write_checkpoint
+            def save():
+                # the whole text is a single chunk
+                write_checkpoint(checkpoint, "", merges, [ids.tolist() if backend == "numpy" else ids], [1])
+        num_merges = vocab_size - 256
+        for i in range(len(merges), num_merges):
+            # find the most common consecutive pair, among the tokens so far
+            pair, count = most_common_pair(ids, 256 + i)
             # mint a new token: assign it the next available id
             idx = 256 + i
             # replace all occurrences of pair in ids with idx
-            ids = merge(ids, pair, idx)
+            ids = merge_pair(ids, pair, idx)
             # save the merge
             merges[pair] = idx
             vocab[idx] = vocab[pair[0]] + vocab[pair[1]]
             # prints
             if verbose:
-                print(f"merge {i+1}/{num_merges}: {pair} -> {idx} ({vocab[idx]}) had {stats[pair]} occurrences")
+                print(f"merge {i+1}/{num_merges}: {pair} -> {idx} ({vocab[idx]}) had {count} occurrences")
+            if checkpoint is not None and (i + 1) % checkpoint_every == 0:
+                save()
+        if checkpoint is not None:
+            save()
 
         # save class variables
         self.merges = merges # used in encode()
@@ -50,25 +103,31 @@ class BasicTokenizer(Tokenizer):
 
     def decode(self, ids):
         # given ids (list of integers), return Python string
-        text_bytes = b"".join(self.vocab[idx] for idx in ids)
+        text_bytes = self.decode_bytes(ids)
         text = text_bytes.decode("utf-8", errors="replace")
         return text
 
+    @instrumented("decode")
+    def decode_bytes(self, ids):
+        # given ids (list of integers), return the raw bytes they stand for
+        ids = list(ids)
+        text_bytes = b"".join(self.vocab[idx] for idx in ids)
+        if self.stats is not None:
+            self.stats.add_counts(tokens=len(ids), bytes=len(text_bytes))
+        return text_bytes
+
+    @instrumented("encode")
     def encode(self, text):
         # given a string text, return the token ids
         text_bytes = text.encode("utf-8") # raw bytes
         ids = list(text_bytes) # list of integers in range 0..255
-        while len(ids) >= 2:
-            # find the pair with the lowest merge index
-            stats = get_stats(ids)
-            pair = min(stats, key=lambda p: self.merges.get(p, float("inf")))
-            # subtle: if there are no more merges available, the key will
-            # result in an inf for every single pair, and the min will be
-            # just the first pair in the list, arbitrarily
-            # we can detect this terminating case by a membership check
-            if pair not in self.merges:
-                break # nothing else can be merged anymore
-            # otherwise let's merge the best pair (lowest merge index)
-            idx = self.merges[pair]
-            ids = merge(ids, pair, idx)
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        # merge the pairs, lowest merge index first, until nothing can be merged
+        ids = apply_merges(ids, self.merges)
+        if stats is not None:
+            # the whole text is one big chunk
+            stats.add_stage("merge", time.perf_counter() - t0)
+            stats.add_chunks([len(text_bytes)], len(ids))
         return ids
@@ -0,0 +1,98 @@
+"""
+A compact binary model file format, as an alternative to the text .model file.
+
+Loading the text format means parsing every merge line by line and then
+rebuilding the whole vocab by concatenating bytes, which for a big vocabulary
+shows up in the startup time. The binary format instead stores everything as
+flat arrays, that are read in one go each. Building the merges and vocab dicts
+from them still takes time linear in the vocab size, but it's a few times
+faster than loading the text format:
+
+- 8 bytes: the magic string b"minbpe\\0b"
+- uint32: the format version (1)
+- uint32: the length of the header
+- the header: JSON with the pattern, the special tokens, the number of merges
+  and the vocab size, plus optional extra fields (e.g. the GPT-4 byte shuffle)
+- zero padding up to a multiple of 8 bytes
+- int32[2 * num_merges]: the merged pairs, in the order of their merge index
+- int64[vocab_size + 1]: the offsets of every token in the bytes blob
+- the bytes blob: the bytes of all the tokens, one after the other
+
+All numbers are little-endian.
+"""
+
+import sys
+import json
+import struct
+from array import array
+
+MAGIC = b"minbpe\0b"
+VERSION = 1
+
+
+def _padding(n):
+    # the number of bytes needed to get from n to a multiple of 8
+    return -n % 8
+
+
+def _to_array(typecode, buffer):
+    # unpack the little-endian buffer into an array of typecode
+    a = array(typecode)
+    a.frombytes(buffer)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+def write_model(path, pattern, special_tokens, merges, vocab, **extra):
+    """
+    Write a model to path in the binary format. The merges must be the usual
+    (int, int) -> int dict with indices 256, 257, ... and the vocab must have
+    the bytes of all the tokens 0..255+len(merges). Any extra keyword arguments
+    are stored in the header, and have to be JSON serializable.
+    """
+    vocab_size = 256 + len(merges)
+    assert list(merges.values()) == list(range(256, vocab_size))
+    pairs = array("i", [idx for pair in merges for idx in pair])
+    tokens = [vocab[idx] for idx in range(vocab_size)]
+    offsets = array("q", [0])
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    if sys.byteorder == "big":
+        pairs.byteswap()
+        offsets.byteswap()
+    header = dict(extra, pattern=pattern, special_tokens=special_tokens,
+                  num_merges=len(merges), vocab_size=vocab_size)
+    header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<II", VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * _padding(len(MAGIC) + 8 + len(header)))
+        f.write(pairs.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b"".join(tokens))
+
+
+def read_model(path):
+    """
+    Read a model written by write_model(). Returns the header dict, with the
+    merges ((int, int) -> int) and the vocab (int -> bytes) added to it.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a binary minbpe model file")
+        version, header_len = struct.unpack("<II", f.read(8))
+        if version != VERSION:
+            raise ValueError(f"unsupported binary minbpe model version {version}")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+        f.read(_padding(len(MAGIC) + 8 + header_len))
+        num_merges, vocab_size = header["num_merges"], header["vocab_size"]
+        # every array is read in one go
+        pairs = _to_array("i", f.read(8 * num_merges))
+        offsets = _to_array("q", f.read(8 * (vocab_size + 1)))
+        blob = f.read(offsets[-1])
+    # build the dicts, by slicing instead of concatenating the bytes of tokens
+    header["merges"] = dict(zip(zip(pairs[0::2], pairs[1::2]), range(256, vocab_size)))
+    header["vocab"] = {idx: blob[offsets[idx]:offsets[idx + 1]] for idx in range(vocab_size)}
+    return header
@@ -0,0 +1,92 @@
+"""
+Training checkpoints: the state of a training run, to resume it after it was
+interrupted, or to continue it later on to a bigger vocabulary.
+
+The state is the merges so far, and all the chunks of the training text as
+they are after those merges, with their counts. The file format is like the
+binary model format (see binary.py), all numbers little-endian:
+
+- 8 bytes: the magic string b"minbpe\\0c"
+- uint32: the format version (1)
+- uint32: the length of the header
+- the header: JSON with the pattern, the number of merges, chunks and ids
+- zero padding up to a multiple of 8 bytes
+- int32[2 * num_merges]: the merged pairs, in the order of their merge index
+- int64[num_chunks + 1]: the offsets of every chunk in the ids
+- int64[num_chunks]: the number of times every chunk occurs in the text
+- uint32[num_ids]: the ids of all the chunks, one after the other
+"""
+
+import os
+import sys
+import json
+import struct
+from array import array
+
+from .binary import _padding, _to_array
+from .training import ChunkStore
+
+MAGIC = b"minbpe\0c"
+VERSION = 1
+
+
+def write_checkpoint(path, pattern, merges, ids, counts):
+    """
+    Write the state of a training run to path: the merges so far, and the chunks
+    (ids, a ChunkStore or a list of lists of token ids) as they are after them,
+    with their counts.
+    The file is replaced atomically, so an interruption while writing it leaves
+    the previous checkpoint intact.
+    """
+    pairs = array("i", [idx for pair in merges for idx in pair])
+    offsets = array("q", [0])
+    flat_ids = array("I")
+    for chunk_ids in ids:
+        flat_ids.extend(chunk_ids)
+        offsets.append(len(flat_ids))
+    counts = array("q", counts)
+    arrays = [pairs, offsets, counts, flat_ids]
+    if sys.byteorder == "big":
+        for a in arrays:
+            a.byteswap()
+    header = dict(pattern=pattern, num_merges=len(merges), num_chunks=len(ids), num_ids=len(flat_ids))
+    header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<II", VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * _padding(len(MAGIC) + 8 + len(header)))
+        for a in arrays:
+            f.write(a.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    """
+    Read a checkpoint written by write_checkpoint(). Returns the header dict,
+    with the merges, the vocab, the ids (a ChunkStore) and the counts added.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a minbpe training checkpoint")
+        version, header_len = struct.unpack("<II", f.read(8))
+        if version != VERSION:
+            raise ValueError(f"unsupported minbpe checkpoint version {version}")
+        header = json.loads(f.read(header_len).decode("utf-8"))
+        f.read(_padding(len(MAGIC) + 8 + header_len))
+        num_merges, num_chunks, num_ids = header["num_merges"], header["num_chunks"], header["num_ids"]
+        # every array is read in one go, like in binary.read_model
+        pairs = _to_array("i", f.read(8 * num_merges))
+        offsets = _to_array("q", f.read(8 * (num_chunks + 1)))
+        counts = _to_array("q", f.read(8 * num_chunks))
+        flat_ids = _to_array("I", f.read(4 * num_ids))
+    merges = dict(zip(zip(pairs[0::2], pairs[1::2]), range(256, 256 + num_merges)))
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    for (p0, p1), idx in merges.items():
+        vocab[idx] = vocab[p0] + vocab[p1]
+    header["merges"] = merges
+    header["vocab"] = vocab
+    header["ids"] = ChunkStore(flat_ids, array("Q", offsets))
+    header["counts"] = counts.tolist()
+    return header
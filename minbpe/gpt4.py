@@ -2,10 +2,16 @@
 Implements the GPT-4 Tokenizer as a light wrapper around the RegexTokenizer.
 Note that this is a pretrained tokenizer. By default and inside init(), it
 loads the pretrained tokenizer from the `cl100k_base` tokenizer of tiktoken.
+Alternatively, it can be built from a local copy of the cl100k_base.tiktoken
+ranks file, in which case tiktoken is not needed (or imported) at all.
 """
 
-import tiktoken
+import os
+import base64
+import struct
+import hashlib
 from .regex import RegexTokenizer
+from .binary import write_model, read_model
 
 
 def bpe(mergeable_ranks, token, max_rank):
@@ -45,6 +51,83 @@ def recover_merges(mergeable_ranks):
 
     return merges
 
+
+def load_tiktoken_bpe(ranks_file):
+    """
+    Read a tiktoken .tiktoken ranks file, e.g. cl100k_base.tiktoken, into a
+    bytes -> rank dict. Every line is a base64 encoded token and its rank.
+    """
+    mergeable_ranks = {}
+    with open(ranks_file, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            token, rank = line.split()
+            mergeable_ranks[base64.b64decode(token)] = int(rank)
+    return mergeable_ranks
+
+
+def get_cache_dir():
+    # where we keep the recovered merges around between runs. set the
+    # MINBPE_CACHE_DIR environment variable to change it, or to "" to disable
+    cache_dir = os.environ.get("MINBPE_CACHE_DIR")
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "minbpe")
+    return cache_dir
+
+
+def hash_mergeable_ranks(mergeable_ranks):
+    # a fingerprint of the ranks, so that a cache never gets used for the wrong ones
+    h = hashlib.sha256()
+    for token, rank in mergeable_ranks.items():
+        h.update(struct.pack("<II", rank, len(token)))
+        h.update(token)
+    return h.hexdigest()
+
+
+def load_merges(mergeable_ranks):
+    """
+    Returns (merges, vocab, byte_shuffle) of the given mergeable ranks, the way
+    GPT4Tokenizer needs them. Recovering the merges takes seconds, so the result
+    is cached on disk (see get_cache_dir), keyed by a hash of the ranks, and
+    later calls just read it back.
+    """
+    cache_dir = get_cache_dir()
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, f"merges-{hash_mergeable_ranks(mergeable_ranks)[:32]}.mbpe")
+        try:
+            model = read_model(cache_file)
+            byte_shuffle = dict(enumerate(model["byte_shuffle"]))
+            return model["merges"], model["vocab"], byte_shuffle
+        except (OSError, ValueError, KeyError):
+            pass # not cached yet (or the file is broken), recover them below
+    merges = recover_merges(mergeable_ranks)
+    # reconstruct the vocab from the merges
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    for (p0, p1), idx in merges.items():
+        vocab[idx] = vocab[p0] + vocab[p1]
+    # now here is another tricky part.
+    # for some reason, the tokens corresponding to individual bytes
+    # are permuted in a different order. This is completely non-sensical
+    # and probably historical, but therefore we have to deal with it here.
+    byte_shuffle = {i: mergeable_ranks[bytes([i])] for i in range(256)}
+    # the binary format can only store merges with the indices 256, 257, ...
+    # a ranks table with gaps in its ranks (e.g. of removed tokens) isn't cached
+    contiguous = list(merges.values()) == list(range(256, 256 + len(merges)))
+    if cache_file is not None and contiguous:
+        # write to a temporary file first, so that concurrent processes never
+        # see a half written cache. failing to cache is not an error
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            write_model(tmp_file, "", {}, merges, vocab, byte_shuffle=[byte_shuffle[i] for i in range(256)])
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return merges, vocab, byte_shuffle
+
 GPT4_SPLIT_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
 GPT4_SPECIAL_TOKENS = {
     '<|endoftext|>': 100257,
@@ -57,23 +140,24 @@ GPT4_SPECIAL_TOKENS = {
 class GPT4Tokenizer(RegexTokenizer):
     """Lightweight wrapper on RegexTokenizer that matches GPT-4's tokenizer."""
 
-    def __init__(self):
-        super().__init__(pattern=GPT4_SPLIT_PATTERN)
-        # get the official tokenizer and its merges
-        enc = tiktoken.get_encoding("cl100k_base")
-        mergeable_ranks = enc._mergeable_ranks
-        # the merges are those of gpt4, but we have to recover them
-        self.merges = recover_merges(mergeable_ranks)
-        # reconstruct the vocab from the merges
-        vocab = {idx: bytes([idx]) for idx in range(256)}
-        for (p0, p1), idx in self.merges.items():
-            vocab[idx] = vocab[p0] + vocab[p1]
-        self.vocab = vocab
-        # now here is another tricky part.
-        # for some reason, the tokens corresponding to individual bytes
-        # are permuted in a different order. This is completely non-sensical
-        # and probably historical, but therefore we have to deal with it here.
-        self.byte_shuffle = {i: mergeable_ranks[bytes([i])] for i in range(256)}
+    def __init__(self, cache_size=0, ranks_file=None):
+        """
+        - cache_size: optional size of the chunk encoding cache, see RegexTokenizer
+        - ranks_file: optional path to a local copy of cl100k_base.tiktoken.
+          If given, the tokenizer is built from it, without tiktoken (which
+          may want to download it). Otherwise we ask tiktoken for cl100k_base.
+        """
+        super().__init__(pattern=GPT4_SPLIT_PATTERN, cache_size=cache_size)
+        if ranks_file is not None:
+            mergeable_ranks = load_tiktoken_bpe(ranks_file)
+        else:
+            # get the official tokenizer and its merges
+            import tiktoken
+            enc = tiktoken.get_encoding("cl100k_base")
+            mergeable_ranks = enc._mergeable_ranks
+        # the merges are those of gpt4, but we have to recover them, along with
+        # the vocab and the permutation of the byte tokens (see load_merges)
+        self.merges, self.vocab, self.byte_shuffle = load_merges(mergeable_ranks)
         self.inverse_byte_shuffle = {v: k for k, v in self.byte_shuffle.items()}
         # finally register the special tokens
         self.register_special_tokens(GPT4_SPECIAL_TOKENS)
@@ -84,12 +168,14 @@ class GPT4Tokenizer(RegexTokenizer):
         ids = super()._encode_chunk(text_bytes)
         return ids
 
-    def decode(self, ids):
-        # we have to un-permute the bytes before we decode
-        text_bytes = b"".join(self.vocab[idx] for idx in ids)
-        text_bytes = bytes(self.inverse_byte_shuffle[b] for b in text_bytes)
-        text = text_bytes.decode("utf-8", errors="replace")
-        return text
+    def _build_decode_table(self):
+        # we have to un-permute the bytes before we decode. instead of doing
+        # that on every decode, we do it once for all the tokens in the table
+        table = super()._build_decode_table()
+        unshuffle = bytes(self.inverse_byte_shuffle[b] for b in range(256))
+        for idx in self.vocab:
+            table[idx] = self.vocab[idx].translate(unshuffle)
+        return table
 
     # this is a pretrained tokenizer, it is not intended to be trained
     def train(self, text, vocab_size, verbose=False):
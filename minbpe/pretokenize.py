@@ -0,0 +1,270 @@
+"""
+Pre-tokenization: splitting the training text into chunks with the regex
+split pattern, and counting how many times every distinct chunk occurs.
+The training text doesn't have to fit in memory, it can be streamed in blocks
+from files or from an iterator of documents.
+
+For big corpora this is the first thing that dominates the training time, and
+it parallelizes trivially: we cut the text into shards, split and count every
+shard in its own process, and add the counts back up.
+
+The catch is where to cut. The split pattern matches in a context dependent
+way (e.g. "\\s+(?!\\S)" looks at what comes after the whitespace), so cutting
+the text in an arbitrary place could change the chunks around the cut. We only
+cut right after a letter or number that is followed by whitespace: neither the
+GPT-2 nor the GPT-4 split pattern ever joins a letter or number with whitespace
+that follows it, so with those patterns the shards split into exactly the same
+chunks as the whole text would. Custom patterns may not have this property,
+so with those the text is not cut: every str and every file is split whole.
+"""
+
+import os
+import codecs
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import regex as re
+from .regex import GPT2_SPLIT_PATTERN, GPT4_SPLIT_PATTERN
+
+# the places where it is safe to cut the text, see the note above
+SPLIT_BOUNDARY_PATTERN = re.compile(r"[\p{L}\p{N}](?=\s)")
+# the same, but searching backwards from the end of the text for the last one
+LAST_SPLIT_BOUNDARY_PATTERN = re.compile(r"(?r)[\p{L}\p{N}](?=\s)")
+
+
+def is_safe_to_cut(pattern):
+    """Whether text split with pattern may be cut at the safe places, see the note above"""
+    return pattern in (GPT2_SPLIT_PATTERN, GPT4_SPLIT_PATTERN)
+
+
+def find_split_boundary(text, start):
+    """Return the first safe place to cut text at or after start, or len(text)"""
+    match = SPLIT_BOUNDARY_PATTERN.search(text, start)
+    return len(text) if match is None else match.end()
+
+
+def find_last_boundary(text, special_pattern=None, max_special_len=1, start=0):
+    """
+    Return the last place where text can be cut, such that both sides encode to
+    the same tokens as the whole, or 0 if there is none. This is used to encode
+    text that arrives in pieces, so only what's before the cut is final: the text
+    after it may still continue. If given, special_pattern is the compiled regex
+    of the special tokens (of at most max_special_len characters) that are
+    matched in the text. Cutting at the start or end of a special token is fine,
+    since the text is split around them anyway, but cutting through one is not,
+    and neither is cutting where a special token may be just starting.
+    Only the text from start on is searched, e.g. when the text before it was
+    already searched without finding a cut, see next_search_start.
+    """
+    end = len(text) - max_special_len + 1 if special_pattern is not None else len(text)
+    match = LAST_SPLIT_BOUNDARY_PATTERN.search(text, start, max(end, start))
+    cut = 0 if match is None else match.end()
+    if special_pattern is not None:
+        for match in special_pattern.finditer(text, start):
+            if match.start() >= end:
+                # this one may still turn out to be part of a longer special token
+                break
+            # cut right after the special token if it's certain, else before it
+            cut = max(cut, match.end()) if match.end() <= end else match.start()
+    return cut
+
+
+def next_search_start(text, max_special_len=1):
+    """
+    Where to continue searching for a cut with find_last_boundary, once text
+    has grown, if the search of all of text found none: the cut can only be in
+    what was added, or in the last few characters before it. (A safe place
+    needs the next character, and a special token may have been incomplete.)
+    This keeps searching a buffer that grows for long without a cut linear.
+    """
+    return max(0, len(text) - 2 * max_special_len)
+
+
+def split_text(text, slice_size, special_pattern=None, max_special_len=1):
+    """
+    Cut text into slices of about slice_size characters, at places found by
+    find_last_boundary, so that encoding the slices one by one gives exactly
+    the same tokens as encoding the whole text. A slice is longer than that
+    if there is no safe place to cut it sooner. Returns the list of slices.
+    """
+    slices = []
+    start = 0
+    while start < len(text):
+        end = next_slice_end(text, start, slice_size, special_pattern, max_special_len)
+        slices.append(text[start:end])
+        start = end
+    return slices
+
+
+def next_slice_end(text, start, slice_size, special_pattern=None, max_special_len=1):
+    """Return where the slice of text from start on ends, see split_text"""
+    if len(text) - start <= slice_size:
+        return len(text)
+    # look for the last safe cut in the next slice_size characters, and in
+    # twice as many, and so on, if there is none. every time, only the part
+    # that is new (plus a bit, see next_search_start) has to be searched
+    size = slice_size
+    window = text[start:start + size]
+    cut = find_last_boundary(window, special_pattern, max_special_len)
+    while cut == 0 and start + size < len(text):
+        size *= 2
+        search_start = next_search_start(window, max_special_len)
+        window = text[start:start + size]
+        cut = find_last_boundary(window, special_pattern, max_special_len, search_start)
+    # (no safe place to cut in all of the rest of the text: it's one slice)
+    return len(text) if cut == 0 else start + cut
+
+
+def iter_text_reads(source, block_size):
+    """
+    Yield the text of source in pieces, where the source can be a str, a file
+    object open in text or binary mode (binary files are decoded as UTF-8), or
+    an iterable of str pieces. The pieces are parts of one continuous text.
+    """
+    if isinstance(source, str):
+        for i in range(0, len(source), block_size):
+            yield source[i:i + block_size]
+    elif hasattr(source, "read"):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            data = source.read(block_size)
+            if not data:
+                break
+            yield decoder.decode(data) if isinstance(data, bytes) else data
+        yield decoder.decode(b"", final=True)
+    else:
+        for piece in source:
+            if not isinstance(piece, str):
+                raise TypeError(f"can't read text from {type(piece).__name__}")
+            yield piece
+
+
+def shard_text(text, shard_size):
+    """Cut text at safe places into shards of roughly shard_size characters"""
+    shards = []
+    start = 0
+    while start < len(text):
+        end = find_split_boundary(text, start + shard_size)
+        shards.append(text[start:end])
+        start = end
+    return shards
+
+
+def count_chunks(texts, pattern):
+    """Split each of texts with the (str) regex pattern, and count the distinct chunks"""
+    # note: Counter remembers the order in which the chunks first appear
+    chunk_counts = Counter()
+    for text in texts:
+        chunk_counts.update(re.findall(pattern, text))
+    return chunk_counts
+
+
+def iter_file_blocks(path, block_size):
+    """
+    Read the text file at path in blocks of about block_size characters, each
+    cut at a safe place, so that they split into the same chunks as the whole
+    file would. The file is read as UTF-8, as is (newlines are not translated).
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        buffer = ""
+        start = 0 # there is no safe place in the buffer before this
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            buffer += data
+            # cut at the last safe place, and carry over the rest
+            match = LAST_SPLIT_BOUNDARY_PATTERN.search(buffer, start)
+            if match is not None:
+                yield buffer[:match.end()]
+                buffer = buffer[match.end():]
+            start = next_search_start(buffer)
+        if buffer:
+            yield buffer
+
+
+def iter_text_blocks(source, block_size, cut=True):
+    """
+    Yield the training text in source as blocks of about block_size characters,
+    that can be split into chunks independently. The source can be:
+    - a str: the text itself
+    - an os.PathLike (e.g. pathlib.Path): a text file, read in blocks
+    - an iterable of the above, e.g. a list of paths or a generator of documents.
+      note that a document always ends a chunk, they are not joined together
+    With cut=False, the text is never cut: every str and every file is a block.
+    """
+    if isinstance(source, str):
+        if cut:
+            yield from shard_text(source, block_size)
+        else:
+            yield source
+    elif isinstance(source, os.PathLike):
+        if cut:
+            yield from iter_file_blocks(source, block_size)
+        else:
+            with open(source, "r", encoding="utf-8", newline="") as f:
+                yield f.read()
+    else:
+        for item in source:
+            if not isinstance(item, (str, os.PathLike)):
+                raise TypeError(f"can't read training text from {type(item).__name__}")
+            yield from iter_text_blocks(item, block_size, cut)
+
+
+def iter_text_batches(source, block_size, cut=True):
+    """Group the blocks of iter_text_blocks into lists of about block_size characters"""
+    # this keeps the work per batch reasonable when the source is a stream of
+    # many small documents, which we can't just glue together into one block
+    batch, size = [], 0
+    for block in iter_text_blocks(source, block_size, cut):
+        batch.append(block)
+        size += len(block)
+        if size >= block_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def count_text_chunks(source, pattern, num_workers=None, block_size=None):
+    """
+    Returns a Counter of chunk -> number of occurrences in the training text,
+    with the chunks in the order they first appear. The source is a str, a
+    path or an iterable of those, see iter_text_blocks. Only a few blocks of
+    the text (per worker) are held in memory at a time.
+    - num_workers: if > 1, the blocks are split and counted in parallel by a
+      pool of num_workers processes
+    - block_size: approximate number of characters per block. By default a
+      str is cut in about 4 blocks per worker (to even out the load), and
+      files are read in blocks of 1M characters
+    If it isn't safe to cut the text for the pattern (see is_safe_to_cut), every
+    str and every file is counted whole, and only separate documents are counted
+    in parallel.
+    """
+    parallel = num_workers is not None and num_workers > 1
+    cut = is_safe_to_cut(pattern)
+    if isinstance(source, str):
+        if not parallel or not cut:
+            return count_chunks([source], pattern)
+        if block_size is None:
+            block_size = max(len(source) // (4 * num_workers), 1 << 16)
+    if block_size is None:
+        block_size = 1 << 20
+    batches = iter_text_batches(source, block_size, cut)
+    chunk_counts = Counter()
+    if not parallel:
+        for batch in batches:
+            chunk_counts.update(count_chunks(batch, pattern))
+        return chunk_counts
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # keep a bounded number of batches in flight, so that we never read much
+        # more of the text than the workers can keep up with. the results are
+        # collected in order, so adding up the counts of the batches one after
+        # the other keeps the chunks in the order of first appearance
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(count_chunks, batch, pattern))
+            if len(pending) >= 2 * num_workers:
+                chunk_counts.update(pending.popleft().result())
+        while pending:
+            chunk_counts.update(pending.popleft().result())
+    return chunk_counts
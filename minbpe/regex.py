@@ -9,8 +9,14 @@ Unlike BasicTokenizer:
 - RegexTokenizer handles optional special tokens.
 """
 
+import time
+import threading
+import functools
 import regex as re
-from .base import Tokenizer, get_stats, merge
+from operator import itemgetter
+from collections import namedtuple
+from .base import Tokenizer, LRUCache, apply_merges, reachable_tokens
+from .stats import instrumented
 
 
 # the main GPT text split patterns, see
@@ -53,104 +59,338 @@ GPT2_SPLIT_PATTERN = r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}
 '''
 GPT4_SPLIT_PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
 
+# returned by RegexTokenizer.cache_info()
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# the async API cuts long texts into slices of about this many characters
+ASYNC_SLICE_SIZE = 1 << 16
+# guards starting the executor of the async API (a lock can't be an attribute
+# of the tokenizer, which has to stay picklable)
+_executor_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    # compiling the split patterns takes a while, so every pattern is only
+    # compiled once, and then shared by all the tokenizers that use it
+    return re.compile(pattern)
+
 
 class RegexTokenizer(Tokenizer):
 
-    def __init__(self, pattern=None):
+    def __init__(self, pattern=None, cache_size=0):
         """
         - pattern: optional string to override the default (GPT-4 split pattern)
         - special_tokens: str -> int dictionary of special tokens
           example: {'<|endoftext|>': 100257}
+        - cache_size: if > 0, remember the encodings of up to this many distinct
+          chunks, evicting the least recently used ones. Natural text repeats
+          the same chunks (" the", ",", ...) over and over, so most chunks are
+          then encoded with a single lookup. See cache_info() for the hit rate.
         """
         super().__init__()
         self.pattern = GPT4_SPLIT_PATTERN if pattern is None else pattern
-        self.compiled_pattern = re.compile(self.pattern)
         self.special_tokens = {}
         self.inverse_special_tokens = {}
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self._decode_table = None # built lazily, see _build_decode_table
+        self._token_index = None # built lazily, see _build_token_index
+        self._special_matchers = {} # allowed_special -> (special, pattern), see _special_matcher
+        self._executor = None # the thread pool of the async API, started lazily
 
-    def train(self, text, vocab_size, verbose=False):
+    def __getstate__(self):
+        # the copy (e.g. in a worker process) starts its own threads, if it needs any
+        state = super().__getstate__()
+        state["_executor"] = None
+        return state
+
+    def train(self, text, vocab_size, verbose=False, num_workers=None, checkpoint=None, checkpoint_every=1000):
+        """
+        - text: the training text. Besides a str, this can also be a path to a
+          text file (an os.PathLike, e.g. pathlib.Path), or an iterable of paths
+          and/or str documents. Files are streamed in blocks, so the corpus
+          doesn't have to fit in memory. (Only with the GPT-2 and GPT-4 split
+          patterns, where it's safe to cut the text, see pretokenize.py. With
+          other patterns every file is read whole.)
+        - num_workers: optional number of processes to split and count the text
+          with. Training itself is sequential, but for big corpora the regex
+          splitting up front is a big cost that parallelizes well. (With other
+          split patterns, only separate documents are split in parallel.)
+        - checkpoint: optional path to save the training state to, every
+          checkpoint_every merges and at the end. See resume_training.
+        """
+        # the training code is only needed (and imported) when we train
+        from .pretokenize import count_text_chunks
+        from .training import ChunkStore
         assert vocab_size >= 256
         num_merges = vocab_size - 256
 
-        # split the text up into text chunks
-        text_chunks = re.findall(self.compiled_pattern, text)
+        # split the text up into text chunks, and count them.
+        # natural text repeats the same chunks (" the", ",", ...) over and
+        # over, so we only keep every distinct chunk once, along with a count
+        # of how many times it occurs. the dict keeps the chunks in the order
+        # they first appear, which keeps ties between merges broken the same way
+        chunk_counts = count_text_chunks(text, self.pattern, num_workers=num_workers)
 
-        # input text preprocessing
-        ids = [list(ch.encode("utf-8")) for ch in text_chunks]
+        # input text preprocessing. all the chunks are packed into one array
+        ids = ChunkStore.from_chunks(ch.encode("utf-8") for ch in chunk_counts)
+        counts = list(chunk_counts.values())
 
         # iteratively merge the most common pairs to create new tokens
-        merges = {} # (int, int) -> int
-        vocab = {idx: bytes([idx]) for idx in range(256)} # idx -> bytes
-        for i in range(num_merges):
-            # count the number of times every consecutive pair appears
-            stats = {}
-            for chunk_ids in ids:
-                # passing in stats will update it in place, adding up counts
-                get_stats(chunk_ids, stats)
-            # find the pair with the highest count
-            pair = max(stats, key=stats.get)
-            # mint a new token: assign it the next available id
-            idx = 256 + i
-            # replace all occurrences of pair in ids with idx
-            ids = [merge(chunk_ids, pair, idx) for chunk_ids in ids]
-            # save the merge
-            merges[pair] = idx
-            vocab[idx] = vocab[pair[0]] + vocab[pair[1]]
-            # prints
+        self._train_merges(ids, counts, num_merges, verbose, checkpoint=checkpoint,
+                           checkpoint_every=checkpoint_every)
+
+    def resume_training(self, checkpoint_file, vocab_size, verbose=False, checkpoint=None, checkpoint_every=1000):
+        """
+        Continue the training run saved in checkpoint_file (see train) until the
+        vocab has vocab_size tokens. This resumes an interrupted run, or grows
+        the vocab of a finished one, with the same merges as an uninterrupted
+        run to vocab_size. The split pattern is the one of the checkpoint. The
+        new state is saved to checkpoint, by default checkpoint_file itself.
+        """
+        from .checkpoint import read_checkpoint
+        state = read_checkpoint(checkpoint_file)
+        if not state["pattern"]:
+            raise ValueError(f"{checkpoint_file} is not a RegexTokenizer checkpoint")
+        num_merges = vocab_size - 256 - len(state["merges"])
+        if num_merges < 0:
+            raise ValueError(f"the checkpoint already has a vocab of {256 + len(state['merges'])} tokens")
+        self.pattern = state["pattern"]
+        checkpoint = checkpoint_file if checkpoint is None else checkpoint
+        self._train_merges(state["ids"], state["counts"], num_merges, verbose, merges=state["merges"],
+                           vocab=state["vocab"], checkpoint=checkpoint, checkpoint_every=checkpoint_every)
+
+    def _train_merges(self, ids, counts, num_merges, verbose, merges=None, vocab=None,
+                      checkpoint=None, checkpoint_every=1000):
+        from .training import train_merges
+        save = None
+        if checkpoint is not None:
+            from .checkpoint import write_checkpoint
+            # the engine merges the chunks in ids in place, so they're up to date
+            def save(merges, vocab):
+                write_checkpoint(checkpoint, self.pattern, merges, ids, counts)
+        # the training engine keeps the pair counts up to date incrementally,
+        # so every merge only touches the chunks that contain the merged pair
+        merges, vocab = train_merges(ids, num_merges, counts=counts, verbose=verbose, merges=merges,
+                                     vocab=vocab, checkpoint=save, checkpoint_every=checkpoint_every)
+        if save is not None:
+            # the final state, to grow the vocab from later on
+            save(merges, vocab)
+
         # save class variables
         self.merges = merges # used in encode()
         self.vocab = vocab   # used in decode()
+        self._clear_caches()
+
+    def load(self, model_file):
+        super().load(model_file)
+        # the loaded model comes with its own special tokens
+        self.register_special_tokens(self.special_tokens)
+        self._clear_caches()
+
+    @property
+    def compiled_pattern(self):
+        # compiled lazily, and then shared through the compile_pattern cache
+        return compile_pattern(self.pattern)
+
+    def _clear_caches(self):
+        # anything we remember about encoding is invalid once the merges change
+        if self.cache is not None:
+            self.cache.clear()
+        self._decode_table = None
+        self._token_index = None
+
+    def cache_info(self):
+        """Statistics of the chunk cache, in the style of functools.lru_cache"""
+        if self.cache is None:
+            return CacheInfo(hits=0, misses=0, maxsize=0, currsize=0)
+        return CacheInfo(self.cache.hits, self.cache.misses, self.cache.maxsize, len(self.cache))
 
     def register_special_tokens(self, special_tokens):
         # special_tokens is a dictionary of str -> int
         # example: {"<|endoftext|>": 100257}
         self.special_tokens = special_tokens
         self.inverse_special_tokens = {v: k for k, v in special_tokens.items()}
+        self._decode_table = None
+        self._special_matchers = {}
+
+    def _special_matcher(self, allowed_special):
+        """
+        Decode the user desire w.r.t. handling of special tokens. Returns the
+        special tokens (str -> int) to look for in the text, and a compiled
+        regex that finds all of them in a single pass (None if there are none).
+        For none_raise that's all the special tokens, which must not be found.
+        The regex is compiled once per allowed_special, and not on every call,
+        which adds up for short inputs like chat messages.
+        """
+        if isinstance(allowed_special, (set, frozenset)):
+            key = frozenset(allowed_special)
+        elif allowed_special in ("all", "none", "none_raise"):
+            key = allowed_special
+        else:
+            raise ValueError(f"allowed_special={allowed_special} not understood")
+        matcher = self._special_matchers.get(key)
+        if matcher is None:
+            if key in ("all", "none_raise"):
+                special = self.special_tokens
+            elif key == "none":
+                special = {}
+            else:
+                special = {k: v for k, v in self.special_tokens.items() if k in key}
+            # note that surrounding the pattern with () makes it into a capturing
+            # group, so that split() keeps the special tokens in its result
+            pattern = re.compile("(" + "|".join(re.escape(k) for k in special) + ")") if special else None
+            matcher = self._special_matchers[key] = (special, pattern)
+        return matcher
+
+    def _build_decode_table(self):
+        # a list indexed by token id, with the bytes of every token (or None
+        # for the ids that aren't tokens). this way decoding is a single gather
+        # over a flat array and one join, instead of a dict lookup per token
+        size = max(max(self.vocab, default=-1), max(self.inverse_special_tokens, default=-1)) + 1
+        table = [None] * size
+        for idx, token in self.vocab.items():
+            table[idx] = token
+        for idx, special in self.inverse_special_tokens.items():
+            table[idx] = special.encode("utf-8")
+        return table
+
+    def _build_token_index(self):
+        # a dict from str to token id, of all the chunks that are a single token:
+        # the text of every token that BPE encodes its own bytes to (not all of
+        # them, see reachable_tokens). most chunks of natural text are a whole
+        # token (" the", "ing", ...), and those are then encoded with a single
+        # lookup, without any merging. the text is that of the decode table, so
+        # the tokens are right for GPT4Tokenizer and its byte shuffle too
+        table = self._decode_table
+        if table is None:
+            table = self._decode_table = self._build_decode_table()
+        index = {}
+        for idx in reachable_tokens(self.merges):
+            try:
+                index[table[idx].decode("utf-8")] = idx
+            except UnicodeDecodeError:
+                pass # part of a character, this is never a whole chunk
+        return index
 
     def decode(self, ids):
         # given ids (list of integers), return Python string
-        part_bytes = []
-        for idx in ids:
-            if idx in self.vocab:
-                part_bytes.append(self.vocab[idx])
-            elif idx in self.inverse_special_tokens:
-                part_bytes.append(self.inverse_special_tokens[idx].encode("utf-8"))
-            else:
-                raise ValueError(f"invalid token id: {idx}")
-        text_bytes = b"".join(part_bytes)
+        text_bytes = self.decode_bytes(ids)
         text = text_bytes.decode("utf-8", errors="replace")
         return text
 
+    @instrumented("decode")
+    def decode_bytes(self, ids):
+        # given ids (list of integers), return the raw bytes they stand for
+        table = self._decode_table
+        if table is None:
+            table = self._decode_table = self._build_decode_table()
+        ids = ids if isinstance(ids, list) else list(ids)
+        try:
+            if ids and min(ids) < 0:
+                raise IndexError # negative indices would silently wrap around
+            # itemgetter gathers all the ids from the table in one call
+            parts = itemgetter(*ids)(table) if len(ids) > 1 else [table[idx] for idx in ids]
+            text_bytes = b"".join(parts)
+        except (IndexError, TypeError):
+            # an id is out of range, or not a token (a None in the table)
+            idx = next(idx for idx in ids if not 0 <= idx < len(table) or table[idx] is None)
+            raise ValueError(f"invalid token id: {idx}")
+        if self.stats is not None:
+            self.stats.add_counts(tokens=len(ids), bytes=len(text_bytes))
+        return text_bytes
+
     def _encode_chunk(self, text_bytes):
         # return the token ids
         # let's begin. first, convert all bytes to integers in range 0..255
         ids = list(text_bytes)
-        while len(ids) >= 2:
-            # find the pair with the lowest merge index
-            stats = get_stats(ids)
-            pair = min(stats, key=lambda p: self.merges.get(p, float("inf")))
-            # subtle: if there are no more merges available, the key will
-            # result in an inf for every single pair, and the min will be
-            # just the first pair in the list, arbitrarily
-            # we can detect this terminating case by a membership check
-            if pair not in self.merges:
-                break # nothing else can be merged anymore
-            # otherwise let's merge the best pair (lowest merge index)
-            idx = self.merges[pair]
-            ids = merge(ids, pair, idx)
-        return ids
+        # then apply the merges, lowest merge index first. see apply_merges for
+        # how this is done efficiently, even for very long chunks
+        return apply_merges(ids, self.merges)
 
+    @instrumented("encode")
     def encode_ordinary(self, text):
         """Encoding that ignores any special tokens."""
+        ids = []
+        self._encode_ordinary_into(ids, text)
+        return ids
+
+    def _encode_ordinary_into(self, ids, text):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+            num_ids, cache_info = len(ids), self.cache_info()
         # split text into chunks of text by categories defined in regex pattern
         text_chunks = re.findall(self.compiled_pattern, text)
+        if stats is not None:
+            t1 = time.perf_counter()
+            stats.add_stage("regex_split", t1 - t0)
         # all chunks of text are encoded separately, then results are joined
-        ids = []
+        # the index is only ever replaced as a whole, never changed, so it can
+        # be shared by all the threads that encode with this tokenizer. (if two
+        # of them build it at the same time, they build the same one)
+        index = self._token_index
+        if index is None:
+            index = self._token_index = self._build_token_index()
+        cache = self.cache
         for chunk in text_chunks:
+            idx = index.get(chunk)
+            if idx is not None:
+                # the chunk is a single token
+                ids.append(idx)
+                continue
+            if cache is not None:
+                # the chunk str determines its bytes, so we can key on it directly
+                chunk_ids = cache.get(chunk)
+                if chunk_ids is None:
+                    chunk_ids = tuple(self._encode_chunk(chunk.encode("utf-8")))
+                    cache.put(chunk, chunk_ids)
+                ids.extend(chunk_ids)
+                continue
             chunk_bytes = chunk.encode("utf-8") # raw bytes
             chunk_ids = self._encode_chunk(chunk_bytes)
             ids.extend(chunk_ids)
-        return ids
+        if stats is not None:
+            stats.add_stage("merge", time.perf_counter() - t1)
+            stats.add_chunks([len(chunk.encode("utf-8")) for chunk in text_chunks], len(ids) - num_ids)
+            # (approximate, if other threads use the same cache at the same time)
+            new_cache_info = self.cache_info()
+            stats.add_counts(index_hits=sum(chunk in index for chunk in text_chunks),
+                             cache_hits=new_cache_info.hits - cache_info.hits,
+                             cache_misses=new_cache_info.misses - cache_info.misses)
+
+    def encode_stream(self, source, allowed_special="none_raise", block_size=1 << 16):
+        """
+        Encode text that is too big to hold in memory, yielding the token ids in
+        batches (lists), one batch per block of about block_size characters. The
+        concatenated batches are exactly encode(text, allowed_special) of the
+        whole text. The source can be a str, a file object (in text mode, or
+        binary mode for UTF-8 files), or an iterable of str pieces of the text.
+        Every block is cut at a safe place, see find_last_boundary, and the rest
+        (an unfinished chunk, or a partially read special token) is carried over
+        to the next block. Only the GPT-2 and GPT-4 split patterns have safe
+        places (see is_safe_to_cut): with any other pattern, all of the text is
+        read first, and encoded at once.
+        """
+        from .pretokenize import find_last_boundary, next_search_start, iter_text_reads, is_safe_to_cut
+        # the special tokens that have to be kept whole. with none_raise, that's
+        # all of them, so that encode() sees (and raises on) any complete one
+        special, special_pattern = self._special_matcher(allowed_special)
+        max_special_len = max((len(k) for k in special), default=1)
+        cut_text = is_safe_to_cut(self.pattern)
+        buffer = ""
+        start = 0 # there is no place to cut in the buffer before this
+        for piece in iter_text_reads(source, block_size):
+            buffer += piece
+            if not cut_text or len(buffer) < block_size:
+                continue
+            cut = find_last_boundary(buffer, special_pattern, max_special_len, start)
+            if cut > 0:
+                yield self.encode(buffer[:cut], allowed_special=allowed_special)
+                buffer = buffer[cut:]
+            start = next_search_start(buffer, max_special_len)
+        if buffer:
+            yield self.encode(buffer, allowed_special=allowed_special)
 
     def encode(self, text, allowed_special="none_raise"):
         """
@@ -160,37 +400,105 @@ class RegexTokenizer(Tokenizer):
         this is the default tiktoken behavior right now as well
         any other behavior is either annoying, or a major footgun
         """
-        # decode the user desire w.r.t. handling of special tokens
-        special = None
-        if allowed_special == "all":
-            special = self.special_tokens
-        elif allowed_special == "none":
-            special = {}
-        elif allowed_special == "none_raise":
-            special = {}
-            assert all(token not in text for token in self.special_tokens)
-        elif isinstance(allowed_special, set):
-            special = {k: v for k, v in self.special_tokens.items() if k in allowed_special}
-        else:
-            raise ValueError(f"allowed_special={allowed_special} not understood")
-        if not special:
+        ids = []
+        self._encode_into(ids, text, allowed_special=allowed_special)
+        return ids
+
+    @instrumented("encode")
+    def _encode_into(self, ids, text, allowed_special="none_raise"):
+        special, special_pattern = self._special_matcher(allowed_special)
+        if allowed_special == "none_raise":
+            # one pass over the text finds any of the special tokens
+            assert special_pattern is None or special_pattern.search(text) is None
+            special_pattern = None
+        if special_pattern is None:
             # shortcut: if no special tokens, just use the ordinary encoding
-            return self.encode_ordinary(text)
+            self._encode_ordinary_into(ids, text)
+            return
         # otherwise, we have to be careful with potential special tokens in text
         # we handle special tokens by splitting the text
         # based on the occurrence of any exact match with any of the special tokens
-        # we can use re.split for this. note that surrounding the pattern with ()
-        # makes it into a capturing group, so the special tokens will be included
-        special_pattern = "(" + "|".join(re.escape(k) for k in special) + ")"
-        special_chunks = re.split(special_pattern, text)
-        # now all the special characters are separated from the rest of the text
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        special_chunks = special_pattern.split(text)
+        if stats is not None:
+            stats.add_stage("special_split", time.perf_counter() - t0)
+        # now all the special characters are separated from the rest of the text:
+        # the ordinary parts are at the even indices, the special tokens at the odd
         # all chunks of text are encoded separately, then results are joined
-        ids = []
-        for part in special_chunks:
-            if part in special:
+        for i, part in enumerate(special_chunks):
+            if i % 2:
                 # this is a special token, encode it separately as a special case
                 ids.append(special[part])
-            else:
+            elif part:
                 # this is an ordinary sequence, encode it normally
-                ids.extend(self.encode_ordinary(part))
+                self._encode_ordinary_into(ids, part)
+
+    # -------------------------------------------------------------------------
+    # async API, e.g. for asyncio servers. the work runs in a thread pool, so it
+    # doesn't block the event loop. encoding only reads the merges, the vocab
+    # and the lookup tables (which are built once, and then never changed), so
+    # all the threads share them. just don't train or load while encoding
+
+    def _get_executor(self):
+        if self._executor is None:
+            with _executor_lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="minbpe")
+        return self._executor
+
+    def close(self):
+        """Shut down the threads of the async API, if they were started"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    async def aencode(self, text, allowed_special="none_raise", slice_size=ASYNC_SLICE_SIZE, executor=None):
+        """
+        The same as encode(text, allowed_special), but run in a thread pool: the
+        tokenizer's own, or the given concurrent.futures executor. A long text
+        is cut into slices of about slice_size characters, at the places that
+        encode_stream cuts at too, and the slices are encoded one after the
+        other. This way a huge prompt doesn't hold up the shorter texts that
+        other tasks are encoding at the same time for long. Only the GPT-2 and
+        GPT-4 split patterns have such places (see is_safe_to_cut): with any
+        other pattern, the text is encoded in one go.
+        """
+        import asyncio
+        from .pretokenize import is_safe_to_cut
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor() if executor is None else executor
+        if not is_safe_to_cut(self.pattern):
+            return await loop.run_in_executor(executor, self.encode, text, allowed_special)
+        # finding the cuts takes time too, so that's done in the executor as well:
+        # every call there looks for the end of the next slice, and encodes it
+        ids, start = [], 0
+        while start < len(text):
+            slice_ids, start = await loop.run_in_executor(
+                executor, self._encode_next_slice, text, start, slice_size, allowed_special)
+            ids += slice_ids
         return ids
+
+    def _encode_next_slice(self, text, start, slice_size, allowed_special):
+        # encode the slice of text from start on, see aencode. returns the ids,
+        # and where the slice ends (where the next one starts)
+        from .pretokenize import next_slice_end
+        special, special_pattern = self._special_matcher(allowed_special)
+        max_special_len = max((len(k) for k in special), default=1)
+        end = next_slice_end(text, start, slice_size, special_pattern, max_special_len)
+        return self.encode(text[start:end], allowed_special=allowed_special), end
+
+    async def aencode_batch(self, texts, allowed_special="none_raise", slice_size=ASYNC_SLICE_SIZE, executor=None):
+        """Encode a list of texts concurrently with aencode(), keeping their order"""
+        import asyncio
+        return list(await asyncio.gather(*(self.aencode(text, allowed_special, slice_size, executor)
+                                           for text in texts)))
+
+    async def adecode(self, ids, executor=None):
+        """The same as decode(ids), but run in a thread pool, see aencode()"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor() if executor is None else executor
+        return await loop.run_in_executor(executor, self.decode, ids)
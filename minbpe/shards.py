@@ -0,0 +1,218 @@
+"""
+Encoding a whole corpus into binary token shards, e.g. to train a model on.
+This is what `python -m minbpe encode` runs, see __main__.py.
+
+The inputs are JSONL files (.jsonl or .json, one JSON document per line, with
+the text under text_key) and plain text files. A text file is one document,
+which is read in blocks that are cut at safe places (see pretokenize.py), so
+that big files never have to be in memory. Only the GPT-2 and GPT-4 split
+patterns have safe places: with any other pattern (or a BasicTokenizer, which
+has none), every text file is read and encoded whole. The documents are encoded by a pool
+of worker processes, as ordinary text (special tokens in the text are not
+treated as special), optionally with a special token appended to every one.
+The tokens of all the documents are then written out back to back, into
+shards of exactly shard_size tokens (only the last shard may be smaller):
+
+    output_dir/shard_000000.bin, ...  the tokens, as raw little-endian uint16
+                                      or uint32 (whichever fits the vocab)
+    output_dir/index.json             the settings, the shards so far, and the
+                                      position in the inputs to continue from
+
+The index is rewritten after every shard. Running again with the same settings
+after an interruption continues from the last complete shard, and gives the
+exact same shards as an uninterrupted run.
+"""
+
+import os
+import sys
+import json
+import time
+from array import array
+from collections import deque
+
+from .base import _init_worker, _encode_array_worker
+from .pretokenize import iter_file_blocks, is_safe_to_cut
+
+INDEX_FILE = "index.json"
+DTYPES = {"H": "uint16", "I": "uint32"}
+
+
+def load_tokenizer(model_file):
+    """Load a .model or .mbpe file, into a RegexTokenizer or a BasicTokenizer"""
+    from .basic import BasicTokenizer
+    from .regex import RegexTokenizer
+    tokenizer = RegexTokenizer()
+    tokenizer.load(model_file)
+    if not tokenizer.pattern:
+        # no split pattern: this was a BasicTokenizer
+        tokenizer = BasicTokenizer()
+        tokenizer.load(model_file)
+    return tokenizer
+
+
+def iter_documents(paths, text_key="text", block_size=1 << 20, start=(0, 0), cut=True):
+    """
+    Yield (file index, document index, text, last) for the documents in the
+    input files, from the position start = (file index, document index) on.
+    For text files, the "documents" are the blocks of the file, and last is
+    only True for the final block. With cut=False, a text file is not cut into
+    blocks, but is a single document.
+    """
+    start_file, start_doc = start
+    for file_idx in range(start_file, len(paths)):
+        path = paths[file_idx]
+        skip = start_doc if file_idx == start_file else 0
+        if os.fspath(path).endswith((".jsonl", ".json")):
+            with open(path, "r", encoding="utf-8") as f:
+                lines = (line for line in f if line.strip())
+                for doc_idx, line in enumerate(lines):
+                    if doc_idx >= skip:
+                        yield file_idx, doc_idx, json.loads(line)[text_key], True
+        else:
+            if cut:
+                blocks = iter_file_blocks(path, block_size)
+            else:
+                with open(path, "r", encoding="utf-8", newline="") as f:
+                    text = f.read()
+                blocks = iter([text] if text else [])
+            block = next(blocks, None)
+            doc_idx = 0
+            while block is not None:
+                next_block = next(blocks, None)
+                if doc_idx >= skip:
+                    yield file_idx, doc_idx, block, next_block is None
+                block, doc_idx = next_block, doc_idx + 1
+
+
+def _iter_batches(documents, batch_size):
+    # group the documents into batches of about batch_size characters
+    batch, size = [], 0
+    for document in documents:
+        batch.append(document)
+        size += len(document[2])
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _encode_documents(tokenizer, documents, num_workers, batch_size):
+    # yield (document, ids) for all the documents, in order
+    from .regex import RegexTokenizer
+    # special tokens in the text are just text. (a BasicTokenizer has none)
+    kwargs = dict(allowed_special="none") if isinstance(tokenizer, RegexTokenizer) else {}
+    batches = _iter_batches(documents, batch_size)
+    if num_workers <= 1:
+        for batch in batches:
+            for document in batch:
+                yield document, tokenizer.encode_array(document[2], **kwargs)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(tokenizer,)) as executor:
+        # a bounded number of batches in flight, collected in order
+        pending = deque()
+        for batch in batches:
+            texts = [document[2] for document in batch]
+            pending.append((batch, executor.submit(_encode_array_worker, texts, kwargs)))
+            if len(pending) >= 2 * num_workers:
+                batch, future = pending.popleft()
+                yield from zip(batch, future.result())
+        while pending:
+            batch, future = pending.popleft()
+            yield from zip(batch, future.result())
+
+
+def _write_atomic(path, data):
+    # write to a temporary file first, so an interruption never leaves a
+    # half written file behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_shard(path, tokens):
+    if sys.byteorder == "big":
+        tokens = array(tokens.typecode, tokens)
+        tokens.byteswap()
+    _write_atomic(path, tokens.tobytes())
+
+
+def encode_corpus(model_file, paths, output_dir, shard_size=10**8, num_workers=None,
+                  text_key="text", append_special=None, block_size=1 << 20, verbose=True):
+    """
+    Encode the files in paths with the tokenizer in model_file, into token
+    shards of shard_size tokens in output_dir, see the note at the top.
+    - num_workers: the number of encoding processes, by default one per CPU
+    - text_key: the key of the text in the documents of JSONL files
+    - append_special: a special token (e.g. "<|endoftext|>") to append to
+      every document
+    - block_size: the number of characters text files are read in at a time,
+      and also about the number of characters sent to a worker at once
+    Returns the index, which is also written to output_dir/index.json
+    """
+    settings = dict(model=os.path.abspath(model_file), inputs=[os.path.abspath(p) for p in paths],
+                    shard_size=shard_size, text_key=text_key, append_special=append_special,
+                    block_size=block_size)
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        # resume from where the previous run left off
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if any(index[key] != value for key, value in settings.items()):
+            raise ValueError(f"{output_dir} has shards made with different settings, use a new output directory")
+        if index["done"]:
+            return index
+    else:
+        index = dict(settings, dtype=None, shards=[], num_tokens=0, position=[0, 0, 0], done=False)
+    tokenizer = load_tokenizer(model_file)
+    typecode = tokenizer.token_typecode()
+    index["dtype"] = DTYPES[typecode]
+    special_id = None if append_special is None else tokenizer.special_tokens[append_special]
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+
+    def save_shard(tokens, position):
+        name = f"shard_{len(index['shards']):06d}.bin"
+        _write_shard(os.path.join(output_dir, name), tokens)
+        index["shards"].append(dict(file=name, num_tokens=len(tokens)))
+        index["num_tokens"] += len(tokens)
+        index["position"] = position
+        _write_atomic(index_path, json.dumps(index, indent=2).encode("utf-8"))
+
+    # the document at the position may already have some of its tokens written
+    file_idx, doc_idx, skip = index["position"]
+    documents = iter_documents(settings["inputs"], text_key, block_size, start=(file_idx, doc_idx),
+                               cut=is_safe_to_cut(tokenizer.pattern))
+    buffer = array(typecode)
+    num_bytes = num_tokens = 0
+    t0 = last_report = time.time()
+    for (file_idx, doc_idx, text, last), ids in _encode_documents(tokenizer, documents, num_workers, block_size):
+        if last and special_id is not None:
+            ids.append(special_id)
+        buffer.extend(ids[skip:] if skip else ids)
+        skip = 0
+        while len(buffer) >= shard_size:
+            # what's left in the buffer is all from the end of this document
+            save_shard(buffer[:shard_size], [file_idx, doc_idx, len(ids) - (len(buffer) - shard_size)])
+            del buffer[:shard_size]
+        num_bytes += len(text.encode("utf-8"))
+        num_tokens += len(ids)
+        if verbose and time.time() - last_report >= 1.0:
+            last_report = time.time()
+            _report(num_bytes, num_tokens, len(index["shards"]), last_report - t0, end="\r")
+    if buffer:
+        # the rest of the tokens, up to the end of the input
+        save_shard(buffer, [len(settings["inputs"]), 0, 0])
+    index["done"] = True
+    _write_atomic(index_path, json.dumps(index, indent=2).encode("utf-8"))
+    if verbose:
+        _report(num_bytes, num_tokens, len(index["shards"]), time.time() - t0, end="\n")
+    return index
+
+
+def _report(num_bytes, num_tokens, num_shards, dt, end):
+    dt = max(dt, 1e-9)
+    print(f"{num_bytes / 1e6:.1f} MB -> {num_tokens:,} tokens, {num_shards} shards | "
+          f"{num_bytes / 1e6 / dt:.2f} MB/s, {num_tokens / dt:,.0f} tokens/s", end=end, file=sys.stderr, flush=True)
@@ -0,0 +1,118 @@
+"""
+Opt-in instrumentation of the tokenizers, to see where the time goes when
+encoding and decoding, and which inputs are slow. Enable it with
+
+    stats = tokenizer.enable_stats(callback=None)
+
+after which every encode and decode call is recorded into stats: the time spent
+in every stage (special_split, regex_split, merge), counters (calls, chunks,
+bytes, tokens, merges, chunks found in the token index, cache hits and misses,
+per op), the longest chunk, and
+histograms of the chunk lengths and of the call latencies. Read them with
+stats.as_dict(). If a callback is given, it is also called after every call
+with a dict of that call alone, e.g. to log the inputs that take long.
+tokenizer.disable_stats() turns it off again. When disabled, the cost is a
+single attribute check per call.
+"""
+
+import time
+import threading
+import functools
+from collections import Counter, defaultdict
+
+COUNTERS = ("chunks", "bytes", "tokens", "merges", "index_hits", "cache_hits", "cache_misses")
+
+
+def _bucket(n):
+    # histogram bucket of n: the smallest power of two >= n
+    return 1 << max(n - 1, 0).bit_length()
+
+
+class TokenizerStats:
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._local = threading.local() # the call in progress, per thread
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = Counter()    # op -> number of calls
+            self.seconds = Counter()  # op or stage -> total seconds
+            self.counters = defaultdict(Counter) # op -> chunks, bytes, tokens, merges, index_hits, ...
+            self.longest_chunk = 0    # in bytes
+            self.chunk_bytes = Counter()  # histogram: bucket -> number of chunks
+            self.latency_us = Counter()   # histogram: bucket -> number of calls
+
+    def as_dict(self):
+        """All the statistics so far, as a (JSON serializable) dict"""
+        with self._lock:
+            counters = {op: dict(counter) for op, counter in self.counters.items()}
+            return dict(calls=dict(self.calls), seconds=dict(self.seconds), counters=counters,
+                        longest_chunk=self.longest_chunk,
+                        histograms=dict(chunk_bytes=dict(sorted(self.chunk_bytes.items())),
+                                        latency_us=dict(sorted(self.latency_us.items()))))
+
+    # the tokenizers report to the call in progress through these
+
+    def add_stage(self, stage, seconds):
+        self._local.call["stages"][stage] += seconds
+
+    def add_chunks(self, byte_lengths, num_tokens):
+        # every merge turns two tokens into one, so the merges applied to the
+        # chunks are the number of bytes minus the number of tokens they end up as
+        call = self._local.call
+        call["chunks"] += len(byte_lengths)
+        call["bytes"] += sum(byte_lengths)
+        call["tokens"] += num_tokens
+        call["merges"] += sum(byte_lengths) - num_tokens
+        call["chunk_bytes"].update(_bucket(n) for n in byte_lengths)
+        call["longest_chunk"] = max(call["longest_chunk"], max(byte_lengths, default=0))
+
+    def add_counts(self, **counts):
+        call = self._local.call
+        for key, n in counts.items():
+            call[key] += n
+
+    def _begin(self, op):
+        call = dict(op=op, seconds=0.0, stages=Counter(), chunks=0, bytes=0, tokens=0, merges=0,
+                    index_hits=0, cache_hits=0, cache_misses=0, longest_chunk=0, chunk_bytes=Counter())
+        self._local.call = call
+        return call
+
+    def _end(self, call):
+        self._local.call = None
+        with self._lock:
+            self.calls[call["op"]] += 1
+            self.seconds[call["op"]] += call["seconds"]
+            self.seconds.update(call["stages"])
+            counter = self.counters[call["op"]]
+            for key in ("bytes", "tokens") if call["op"] == "decode" else COUNTERS:
+                counter[key] += call[key]
+            self.longest_chunk = max(self.longest_chunk, call["longest_chunk"])
+            self.chunk_bytes.update(call.pop("chunk_bytes"))
+            self.latency_us[_bucket(int(call["seconds"] * 1e6))] += 1
+        if self.callback is not None:
+            call["stages"] = dict(call["stages"])
+            self.callback(call)
+
+
+def instrumented(op):
+    """Decorator for the tokenizer methods that count as one op call in the stats"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if stats is None or getattr(stats._local, "call", None) is not None:
+                # disabled, or this is part of a call that's already recorded
+                return method(self, *args, **kwargs)
+            call = stats._begin(op)
+            t0 = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                call["seconds"] = time.perf_counter() - t0
+                stats._end(call)
+        return wrapper
+    return decorator
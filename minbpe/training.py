@@ -0,0 +1,197 @@
+"""
+Incremental BPE training.
+
+The straightforward training loop (see BasicTokenizer.train) recounts every
+consecutive pair in the whole corpus, and then re-merges every chunk, for
+every single new token. That is O(num_merges * corpus_size) and becomes
+hopeless for big vocabularies on big corpora.
+
+Here instead we keep the pair counts alive across merges, together with an
+index from each pair to the chunks it occurs in. Minting a new token then only
+touches the chunks that actually contain the merged pair, and a heap keyed on
+the counts finds the next pair to merge without scanning all of them.
+
+The merges are identical to the ones of the straightforward loop, including
+the way ties are broken: when several pairs share the highest count, the one
+that occurs first in the text wins (this is what max() over the insertion
+ordered stats dict does in the simple loop).
+"""
+
+import heapq
+from array import array
+from .base import merge
+
+
+class ChunkStore:
+    """
+    The chunks of the training text, packed into one array of token ids, 4 bytes
+    per id. (A Python list per chunk costs a lot more: 8 bytes per id, plus the
+    list itself, plus an int object for every id above 256.) Every chunk has its
+    offset into the array and its current length. Merging only ever makes a
+    chunk shorter, so a merged chunk is written back in place, at its offset.
+    It can be used like a list of chunks: store[j] is chunk j (as an array),
+    and store[j] = new_ids replaces it.
+    """
+
+    __slots__ = ("ids", "offsets", "lengths")
+
+    def __init__(self, ids, offsets):
+        # ids: array("I") of all the ids, offsets: array("Q") with the start of
+        # every chunk and the end of the last one
+        self.ids = ids
+        self.offsets = offsets
+        self.lengths = array("I", [end - start for start, end in zip(offsets, offsets[1:])])
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Pack chunks, an iterable of sequences of ids (e.g. bytes objects)"""
+        ids = array("I")
+        offsets = array("Q", [0])
+        for chunk in chunks:
+            ids.extend(chunk)
+            offsets.append(len(ids))
+        return cls(ids, offsets)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, j):
+        start = self.offsets[j]
+        return self.ids[start:start + self.lengths[j]].tolist()
+
+    def __setitem__(self, j, chunk_ids):
+        # chunk_ids must be no longer than the chunk was to begin with
+        start = self.offsets[j]
+        n = len(chunk_ids)
+        self.ids[start:start + n] = array("I", chunk_ids)
+        self.lengths[j] = n
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self[j]
+
+
+def _first_occurrence(pair, ids, where, vocab):
+    # the position of the first occurrence of pair in the text, as a tuple of
+    # (chunk index, byte offset into the chunk). we use byte offsets and not
+    # token positions because they don't shift around as the chunk gets merged
+    j = min(where[pair])
+    offset = 0
+    chunk_ids = ids[j]
+    for p in zip(chunk_ids, chunk_ids[1:]):
+        if p == pair:
+            return j, offset
+        offset += len(vocab[p[0]])
+    raise AssertionError(f"pair {pair} not found in chunk {j}")
+
+
+def train_merges(ids, num_merges, counts=None, verbose=False, merges=None, vocab=None,
+                 checkpoint=None, checkpoint_every=1000):
+    """
+    Run num_merges BPE merges over ids, a list of chunks (each a list of byte
+    values 0..255), or a ChunkStore of them. The chunks are merged in place,
+    and only the chunks that contain the merged pair are rewritten. Returns
+    (merges, vocab).
+    - counts: optional list with the number of times each chunk occurs in the
+      text. This way every distinct chunk only has to be stored (and merged)
+      once, and the result is the same as if it had been repeated.
+    - merges, vocab: optional merges (and their vocab) done before, to continue
+      a training run from, e.g. from a checkpoint. The chunks in ids must then
+      already be merged with them. num_merges more merges are done after them,
+      exactly the same ones an uninterrupted run would have done.
+    - checkpoint: optional function, called as checkpoint(merges, vocab) every
+      checkpoint_every merges. At that point, ids has the merged chunks.
+    Training stops early if there is nothing left to merge.
+    """
+    counts = [1] * len(ids) if counts is None else counts
+    merges = {} if merges is None else dict(merges) # (int, int) -> int
+    vocab = {idx: bytes([idx]) for idx in range(256)} if vocab is None else dict(vocab) # idx -> bytes
+    start = len(merges)
+
+    # the live training state:
+    stats = {} # (int, int) -> count of the pair in the whole text
+    where = {} # (int, int) -> set of indices of the chunks the pair occurs in
+    first = {} # (int, int) -> lower bound on the position of its first occurrence
+    for j, (chunk_ids, n) in enumerate(zip(ids, counts)):
+        offset = 0
+        for pair in zip(chunk_ids, chunk_ids[1:]):
+            stats[pair] = stats.get(pair, 0) + n
+            where.setdefault(pair, set()).add(j)
+            if pair not in first:
+                first[pair] = (j, offset)
+            offset += len(vocab[pair[0]])
+    # a max-heap (via negated counts) of (-count, first_chunk, first_offset, pair)
+    # entries go stale as counts change, we skip those lazily when popping
+    heap = [(-count, *first[pair], pair) for pair, count in stats.items()]
+    heapq.heapify(heap)
+
+    for i in range(num_merges):
+        # find the pair with the highest count, ties going to the earliest pair
+        pair = None
+        while heap:
+            neg_count, j, offset, candidate = heapq.heappop(heap)
+            if stats.get(candidate) != -neg_count:
+                continue # stale entry, the count of this pair has changed
+            # the first occurrence of a pair can only ever move forward in the
+            # text (its occurrences disappear, they never appear), so the
+            # position stored in the heap is a lower bound. re-check it
+            position = _first_occurrence(candidate, ids, where, vocab)
+            if position != (j, offset):
+                first[candidate] = position
+                heapq.heappush(heap, (neg_count, *position, candidate))
+                continue
+            pair = candidate
+            break
+        if pair is None:
+            break # every chunk is a single token, nothing left to merge
+        count = stats[pair]
+        # mint a new token: assign it the next available id
+        idx = 256 + start + i
+        merges[pair] = idx
+        vocab[idx] = vocab[pair[0]] + vocab[pair[1]]
+
+        # replace all occurrences of pair with idx, but only in the chunks that
+        # have it. as we go, collect how the counts of all the pairs change
+        deltas = {}
+        for j in sorted(where[pair]):
+            chunk_ids = ids[j]
+            n = counts[j]
+            new_ids = merge(chunk_ids, pair, idx)
+            old_pairs = set()
+            for p in zip(chunk_ids, chunk_ids[1:]):
+                deltas[p] = deltas.get(p, 0) - n
+                old_pairs.add(p)
+            new_pairs = set()
+            offset = 0
+            for p in zip(new_ids, new_ids[1:]):
+                deltas[p] = deltas.get(p, 0) + n
+                new_pairs.add(p)
+                # any pair we haven't seen before contains the new token, and
+                # since we go over the chunks in order, this is its first occurrence
+                if p not in first:
+                    first[p] = (j, offset)
+                offset += len(vocab[p[0]])
+            for p in old_pairs - new_pairs:
+                where[p].discard(j)
+            for p in new_pairs - old_pairs:
+                where.setdefault(p, set()).add(j)
+            ids[j] = new_ids
+
+        # apply the changes in counts, and push the updated counts on the heap
+        for p, delta in deltas.items():
+            if delta == 0:
+                continue
+            new_count = stats.get(p, 0) + delta
+            if new_count == 0:
+                del stats[p], where[p], first[p]
+            else:
+                stats[p] = new_count
+                heapq.heappush(heap, (-new_count, *first[p], p))
+
+        # prints
+        if verbose:
+            print(f"merge {start+i+1}/{start+num_merges}: {pair} -> {idx} ({vocab[idx]}) had {count} occurrences")
+        if checkpoint is not None and (i + 1) % checkpoint_every == 0:
+            checkpoint(merges, vocab)
+
+    return merges, vocab
@@ -1,4 +1,5 @@
 import unicodedata
+from .base import get_stats_batch # counting the pairs of many sequences at once
 
 def get_stats(ids: list[int], counts:dict=None):
     """
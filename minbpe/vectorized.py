@@ -0,0 +1,63 @@
+"""
+NumPy versions of the helpers of the BasicTokenizer training loop (get_stats
+and merge in base.py), for BasicTokenizer.train(..., backend="numpy").
+
+The ids are held in one int32 array, and every step is a handful of
+vectorized operations over it, instead of a Python loop over every single id.
+The results are exactly the same as those of the Python versions, including
+how ties are broken and how overlapping runs like "aaa" are merged.
+"""
+
+import numpy as np
+
+# up to this many possible pairs (vocab_size ** 2), the pairs are counted with
+# a bincount over a table of all of them. beyond that the table gets too big,
+# and we count by sorting instead
+BINCOUNT_MAX_PAIRS = 1 << 22
+
+
+def most_common_pair(ids, vocab_size):
+    """
+    Return the most common consecutive pair in the array ids (of tokens below
+    vocab_size) and its count. Ties go to the pair that occurs first, which is
+    what max() over the dict of get_stats does in the Python version.
+    """
+    # pack every pair into one int64 key
+    keys = ids[:-1].astype(np.int64) * vocab_size + ids[1:]
+    if vocab_size * vocab_size <= BINCOUNT_MAX_PAIRS:
+        counts = np.bincount(keys)
+        count = counts.max()
+        best = np.flatnonzero(counts == count)
+    else:
+        unique, counts = np.unique(keys, return_counts=True)
+        count = counts.max()
+        best = unique[counts == count]
+    if len(best) > 1:
+        # a tie: take the one of them that occurs first
+        key = keys[np.flatnonzero(np.isin(keys, best))[0]]
+    else:
+        key = best[0]
+    return (int(key // vocab_size), int(key % vocab_size)), int(count)
+
+
+def merge(ids, pair, idx):
+    """
+    In the array ids, replace all consecutive occurrences of pair with the new
+    token idx, going left to right. Returns a new array.
+    """
+    match = (ids[:-1] == pair[0]) & (ids[1:] == pair[1])
+    if pair[0] == pair[1]:
+        # in a run of the same token, like "aaaaa", the matches overlap. going
+        # left to right, the 1st, 3rd, 5th, ... match of every run get merged
+        # (and the others are part of those), so we keep every other match,
+        # counting from the start of its run
+        positions = np.arange(len(match))
+        starts = match & ~np.concatenate(([False], match[:-1]))
+        run_start = np.maximum.accumulate(np.where(starts, positions, 0))
+        match &= (positions - run_start) % 2 == 0
+    where = np.flatnonzero(match)
+    out = ids.copy()
+    out[where] = idx
+    keep = np.ones(len(ids), dtype=bool)
+    keep[where + 1] = False
+    return out[keep]
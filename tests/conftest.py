@@ -0,0 +1,38 @@
+import os
+import functools
+import pytest
+
+from minbpe import RegexTokenizer
+
+# -----------------------------------------------------------------------------
+# common test data, shared by the test modules
+
+@functools.lru_cache(maxsize=None)
+def taylorswift():
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(dirname, "taylorswift.txt"), "r", encoding="utf-8") as f:
+        return f.read()
+
+special_tokens = {
+    '<|endoftext|>': 100257,
+    '<|fim_prefix|>': 100258,
+    '<|fim_middle|>': 100259,
+    '<|fim_suffix|>': 100260,
+    '<|endofprompt|>': 100276
+}
+
+@pytest.fixture(scope="session")
+def trained_tokenizer():
+    # don't change this one, make a copy with make_tokenizer instead
+    tokenizer = RegexTokenizer()
+    tokenizer.train(taylorswift(), 256 + 256)
+    tokenizer.register_special_tokens(special_tokens)
+    return tokenizer
+
+def make_tokenizer(trained_tokenizer, **kwargs):
+    # a fresh tokenizer with the same merges, but the given constructor options
+    tokenizer = RegexTokenizer(**kwargs)
+    tokenizer.merges = trained_tokenizer.merges
+    tokenizer.vocab = trained_tokenizer.vocab
+    tokenizer.register_special_tokens(trained_tokenizer.special_tokens)
+    return tokenizer
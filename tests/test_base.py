@@ -0,0 +1,120 @@
+import random
+import pytest
+
+from minbpe import BasicTokenizer, StreamingDecoder
+from minbpe.base import get_stats, get_stats_batch, merge, apply_merges, reachable_tokens
+from .conftest import taylorswift
+
+# -----------------------------------------------------------------------------
+# common test data
+
+def reference_apply_merges(ids, merges):
+    # the straightforward encoding loop, O(n^2)
+    while len(ids) >= 2:
+        stats = get_stats(ids)
+        pair = min(stats, key=lambda p: merges.get(p, float("inf")))
+        if pair not in merges:
+            break
+        ids = merge(ids, pair, merges[pair])
+    return ids
+
+# -----------------------------------------------------------------------------
+# tests
+
+@pytest.mark.parametrize("ids, merges, expected", [
+    ([], {}, []),
+    ([97], {}, [97]),
+    ([97, 97, 97], {(97, 97): 256}, [256, 97]),
+    ([97, 97, 97, 97], {(97, 97): 256}, [256, 256]),
+    ([97, 97, 97, 97], {(97, 97): 256, (256, 256): 257}, [257]),
+    ([1, 2, 3], {(2, 3): 256, (1, 2): 257}, [1, 256]),
+])
+def test_apply_merges(ids, merges, expected):
+    assert apply_merges(ids, merges) == expected
+
+def test_apply_merges_matches_reference():
+    text = taylorswift()
+    tokenizer = BasicTokenizer()
+    tokenizer.train(text[:5000], 256 + 64)
+    rng = random.Random(1337)
+    samples = ["a" * 100, " " * 77, "abab" * 30, text[:3000]]
+    samples += [text[i:i + rng.randint(1, 200)] for i in (rng.randrange(len(text)) for _ in range(100))]
+    for sample in samples:
+        ids = list(sample.encode("utf-8"))
+        assert apply_merges(ids, tokenizer.merges) == reference_apply_merges(ids, tokenizer.merges)
+
+def test_reachable_tokens():
+    assert reachable_tokens({(98, 99): 256, (97, 98): 257, (257, 99): 258}) == set(range(258))
+    # random merges over a tiny alphabet, with lots of tokens that aren't reachable
+    rng = random.Random(1337)
+    num_unreachable = 0
+    for _ in range(200):
+        merges, vocab = {}, {idx: bytes([idx]) for idx in range(256)}
+        tokens = list(range(97, 97 + rng.randint(1, 4)))
+        for idx in range(256, 256 + rng.randint(1, 40)):
+            pair = (rng.choice(tokens), rng.choice(tokens))
+            if pair not in merges:
+                merges[pair] = len(vocab)
+                vocab[len(vocab)] = vocab[pair[0]] + vocab[pair[1]]
+                tokens.append(merges[pair])
+        reachable = reachable_tokens(merges)
+        for idx, token in vocab.items():
+            assert (idx in reachable) == (apply_merges(list(token), merges) == [idx])
+        num_unreachable += len(vocab) - len(reachable)
+    assert num_unreachable > 100
+
+@pytest.mark.parametrize("text", ["", "hello world", "안녕하세요 😉 👋🏽 ünïcödé", "FILE"])
+def test_streaming_decoder(text):
+    if text == "FILE":
+        text = taylorswift()[:3000]
+    # with only byte tokens, every multi-byte character gets split up
+    tokenizer = BasicTokenizer()
+    ids = tokenizer.encode(text)
+    decoder = StreamingDecoder(tokenizer)
+    pieces = [decoder.add(idx) for idx in ids]
+    assert "".join(pieces) + decoder.flush() == text
+    # incomplete characters are held back, and never come out as �
+    assert all("�" not in piece for piece in pieces)
+
+def test_streaming_decoder_invalid_utf8():
+    tokenizer = BasicTokenizer()
+    rng = random.Random(1337)
+    for _ in range(100):
+        ids = [rng.randrange(256) for _ in range(rng.randint(0, 20))]
+        decoder = StreamingDecoder(tokenizer)
+        text = "".join(decoder.add(idx) for idx in ids) + decoder.flush()
+        assert text == tokenizer.decode(ids)
+    # the decoder can be reused after a flush
+    decoder = StreamingDecoder(tokenizer)
+    assert decoder.add(0xf0) == "" and decoder.flush() == "�"
+    assert decoder.add(104) == "h"
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_get_stats_batch(backend):
+    if backend == "numpy":
+        pytest.importorskip("numpy")
+    assert get_stats_batch([[1, 2, 3], [1, 2]], [1, 10], backend=backend) == {(1, 2): 11, (2, 3): 1}
+    assert get_stats_batch([], backend=backend) == {}
+    rng = random.Random(1337)
+    for _ in range(200):
+        # many short sequences, with the empty and single id ones in between
+        seqs = [[rng.randrange(5) for _ in range(rng.randint(0, 6))] for _ in range(rng.randint(0, 10))]
+        weights = [rng.randint(1, 1000) for _ in seqs]
+        expected = {}
+        for ids in seqs:
+            get_stats(ids, expected)
+        # same counts, in the same (first occurrence) order
+        assert list(get_stats_batch(seqs, backend=backend).items()) == list(expected.items())
+        expected = {}
+        for ids, weight in zip(seqs, weights):
+            for pair, n in get_stats(ids).items():
+                expected[pair] = expected.get(pair, 0) + n * weight
+        assert list(get_stats_batch(seqs, weights, backend=backend).items()) == list(expected.items())
+
+def test_get_stats_batch_auto():
+    text = taylorswift()
+    seqs = [list(line.encode("utf-8")) for line in text.splitlines()]
+    expected = get_stats_batch(seqs, backend="python")
+    assert list(get_stats_batch(seqs).items()) == list(expected.items())
+    with pytest.raises(ValueError):
+        get_stats_batch(seqs, backend="gpu")
@@ -0,0 +1,55 @@
+import os
+import pytest
+
+from minbpe import BasicTokenizer, RegexTokenizer
+from minbpe.regex import GPT2_SPLIT_PATTERN
+from minbpe.binary import write_model, read_model
+from .conftest import taylorswift, special_tokens
+
+# -----------------------------------------------------------------------------
+# tests
+
+def test_write_read_model(tmp_path):
+    merges = {(97, 97): 256, (256, 98): 257}
+    vocab = {idx: bytes([idx]) for idx in range(256)}
+    vocab[256], vocab[257] = b"aa", b"aab"
+    path = str(tmp_path / "toy.mbpe")
+    write_model(path, GPT2_SPLIT_PATTERN, {"<|endoftext|>": 258}, merges, vocab, extra=[1, 2])
+    model = read_model(path)
+    assert model["pattern"] == GPT2_SPLIT_PATTERN
+    assert model["special_tokens"] == {"<|endoftext|>": 258}
+    assert model["extra"] == [1, 2]
+    assert model["merges"] == merges
+    assert model["vocab"] == vocab
+
+def test_read_model_not_binary(tmp_path):
+    path = tmp_path / "not.mbpe"
+    path.write_bytes(b"minbpe v1\n")
+    with pytest.raises(ValueError):
+        read_model(str(path))
+
+@pytest.mark.parametrize("tokenizer_factory", [BasicTokenizer, RegexTokenizer])
+def test_save_load_binary(tmp_path, tokenizer_factory):
+    text = taylorswift()
+    tokenizer = tokenizer_factory()
+    tokenizer.train(text[:10000], 256 + 64)
+    if tokenizer_factory is RegexTokenizer:
+        tokenizer.register_special_tokens(special_tokens)
+        text += "<|endoftext|>"
+    encode = lambda tok: tok.encode(text, "all") if tokenizer_factory is RegexTokenizer else tok.encode(text)
+    ids = encode(tokenizer)
+    prefix = str(tmp_path / "tok")
+    tokenizer.save(prefix, binary=True)
+    assert os.path.exists(prefix + ".mbpe") and os.path.exists(prefix + ".vocab")
+    assert not os.path.exists(prefix + ".model")
+    loaded = tokenizer_factory()
+    loaded.load(prefix + ".mbpe")
+    # the binary format gives the same tokenizer as the text format
+    tokenizer.save(prefix)
+    text_loaded = tokenizer_factory()
+    text_loaded.load(prefix + ".model")
+    assert loaded.merges == text_loaded.merges == tokenizer.merges
+    assert loaded.vocab == text_loaded.vocab
+    assert loaded.special_tokens == text_loaded.special_tokens
+    assert encode(loaded) == ids
+    assert loaded.decode(ids) == text
@@ -0,0 +1,112 @@
+import os
+import sys
+import base64
+import random
+import subprocess
+import pytest
+
+from minbpe import RegexTokenizer, GPT4Tokenizer
+from minbpe import gpt4
+from minbpe.gpt4 import recover_merges, load_merges, load_tiktoken_bpe, GPT4_SPLIT_PATTERN, GPT4_SPECIAL_TOKENS
+from .conftest import taylorswift
+
+# -----------------------------------------------------------------------------
+# common test data
+
+@pytest.fixture(scope="module")
+def mergeable_ranks():
+    # a small tiktoken style bytes -> rank table, made from a trained tokenizer.
+    # like the real one, it comes with its byte tokens permuted
+    tokenizer = RegexTokenizer()
+    tokenizer.train(taylorswift(), 256 + 128)
+    permutation = list(range(256))
+    random.Random(42).shuffle(permutation)
+    ranks = {bytes([i]): permutation[i] for i in range(256)}
+    ranks = dict(sorted(ranks.items(), key=lambda item: item[1]))
+    inverse = {rank: i for i, rank in enumerate(permutation)}
+    vocab = {idx: bytes([inverse[idx]]) for idx in range(256)}
+    for (p0, p1), idx in tokenizer.merges.items():
+        vocab[idx] = vocab[p0] + vocab[p1]
+        ranks[vocab[idx]] = idx
+    return ranks
+
+# -----------------------------------------------------------------------------
+# tests
+
+def test_load_merges_cache(tmp_path, monkeypatch, mergeable_ranks):
+    monkeypatch.setenv("MINBPE_CACHE_DIR", str(tmp_path))
+    merges, vocab, byte_shuffle = load_merges(mergeable_ranks)
+    assert merges == recover_merges(mergeable_ranks)
+    assert byte_shuffle == {i: mergeable_ranks[bytes([i])] for i in range(256)}
+    assert len(os.listdir(tmp_path)) == 1
+    # the second time around, the merges come from the cache
+    monkeypatch.setattr(gpt4, "recover_merges", None)
+    assert load_merges(mergeable_ranks) == (merges, vocab, byte_shuffle)
+
+def test_load_merges_cache_disabled(tmp_path, monkeypatch, mergeable_ranks):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MINBPE_CACHE_DIR", "")
+    merges, _, _ = load_merges(mergeable_ranks)
+    assert merges == recover_merges(mergeable_ranks)
+    assert os.listdir(tmp_path) == []
+
+def test_load_merges_cache_gaps(tmp_path, monkeypatch):
+    # ranks with a gap can't be written to the cache, but work all the same
+    monkeypatch.setenv("MINBPE_CACHE_DIR", str(tmp_path))
+    ranks = {bytes([i]): i for i in range(256)}
+    ranks.update({b"ab": 256, b"abc": 300})
+    merges, vocab, _ = load_merges(ranks)
+    assert merges == {(97, 98): 256, (256, 99): 300} and vocab[300] == b"abc"
+    assert os.listdir(tmp_path) == []
+
+def test_load_merges_cache_keyed_by_ranks(tmp_path, monkeypatch, mergeable_ranks):
+    monkeypatch.setenv("MINBPE_CACHE_DIR", str(tmp_path))
+    load_merges(mergeable_ranks)
+    # drop the last token: a different table must not use the same cache file
+    fewer_ranks = dict(list(mergeable_ranks.items())[:-1])
+    merges, _, _ = load_merges(fewer_ranks)
+    assert merges == recover_merges(fewer_ranks)
+    assert len(os.listdir(tmp_path)) == 2
+
+def write_ranks_file(path, mergeable_ranks):
+    with open(path, "wb") as f:
+        for token, rank in mergeable_ranks.items():
+            f.write(base64.b64encode(token) + b" " + str(rank).encode() + b"\n")
+
+def test_load_tiktoken_bpe(tmp_path, mergeable_ranks):
+    path = tmp_path / "toy.tiktoken"
+    write_ranks_file(path, mergeable_ranks)
+    assert load_tiktoken_bpe(path) == mergeable_ranks
+
+def test_gpt4_tokenizer_from_ranks_file(tmp_path, monkeypatch, mergeable_ranks):
+    monkeypatch.setenv("MINBPE_CACHE_DIR", str(tmp_path))
+    path = tmp_path / "toy.tiktoken"
+    write_ranks_file(path, mergeable_ranks)
+    tokenizer = GPT4Tokenizer(ranks_file=path)
+    # compare to tiktoken, with the same ranks, built locally
+    import tiktoken
+    enc = tiktoken.Encoding(name="toy", pat_str=GPT4_SPLIT_PATTERN,
+                            mergeable_ranks=mergeable_ranks, special_tokens=GPT4_SPECIAL_TOKENS)
+    text = taylorswift()
+    assert tokenizer.encode(text) == enc.encode(text)
+    assert tokenizer.decode(tokenizer.encode(text)) == text
+    text = "<|endoftext|>hello world<|endofprompt|>"
+    assert tokenizer.encode(text, allowed_special="all") == enc.encode(text, allowed_special="all")
+
+def test_import_without_tiktoken():
+    # building the tokenizer from a local file doesn't need tiktoken at all
+    code = "import sys, minbpe; from minbpe.gpt4 import GPT4Tokenizer; assert 'tiktoken' not in sys.modules"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+
+def test_gpt4_decode(tmp_path, monkeypatch, mergeable_ranks):
+    monkeypatch.setenv("MINBPE_CACHE_DIR", str(tmp_path))
+    path = tmp_path / "toy.tiktoken"
+    write_ranks_file(path, mergeable_ranks)
+    tokenizer = GPT4Tokenizer(ranks_file=path)
+    text = taylorswift() + "<|endoftext|>"
+    ids = tokenizer.encode(text, allowed_special="all")
+    assert tokenizer.decode(ids) == text
+    # the table has the real (un-permuted) bytes of every token
+    for token, rank in mergeable_ranks.items():
+        assert tokenizer._decode_table[rank] == token
@@ -0,0 +1,129 @@
+from collections import Counter
+import pytest
+
+import regex as re
+from minbpe import RegexTokenizer
+from minbpe.regex import GPT2_SPLIT_PATTERN, GPT4_SPLIT_PATTERN
+from minbpe.pretokenize import is_safe_to_cut, find_split_boundary, find_last_boundary, split_text, shard_text, iter_file_blocks, count_text_chunks
+from .conftest import taylorswift
+
+# -----------------------------------------------------------------------------
+# common test data
+
+tricky_string = "hello  world's\n\n  foo!!\n\t 123456 안녕 \r\n   x  \n'll 'LL   "
+
+# -----------------------------------------------------------------------------
+# tests
+
+def test_find_split_boundary():
+    text = "ab  cd!! ef"
+    assert find_split_boundary(text, 0) == 2 # right after "ab"
+    assert find_split_boundary(text, 3) == len(text) # "!!" is not a letter
+    assert find_split_boundary(text, 100) == len(text)
+
+@pytest.mark.parametrize("pattern", [GPT2_SPLIT_PATTERN, GPT4_SPLIT_PATTERN])
+@pytest.mark.parametrize("shard_size", [1, 3, 7, 1000])
+def test_shards_split_like_the_whole(pattern, shard_size):
+    text = tricky_string * 5
+    shards = shard_text(text, shard_size)
+    assert "".join(shards) == text
+    chunks = [chunk for shard in shards for chunk in re.findall(pattern, shard)]
+    assert chunks == re.findall(pattern, text)
+
+def test_count_text_chunks_parallel():
+    text = taylorswift()
+    serial = count_text_chunks(text, GPT4_SPLIT_PATTERN)
+    parallel = count_text_chunks(text, GPT4_SPLIT_PATTERN, num_workers=2, block_size=10000)
+    # same counts, and the chunks are in the same order of first appearance
+    assert list(parallel.items()) == list(serial.items())
+
+@pytest.mark.parametrize("num_workers", [None, 4])
+def test_count_text_chunks_custom_pattern(tmp_path, num_workers):
+    # a pattern that joins letters with the whitespace after them: cutting the
+    # text after a letter would change its chunks, so it isn't cut at all
+    pattern = r"[^\n]+|\n"
+    assert not is_safe_to_cut(pattern) and is_safe_to_cut(GPT4_SPLIT_PATTERN)
+    text = taylorswift()
+    expected = Counter(re.findall(pattern, text))
+    path = tmp_path / "taylorswift.txt"
+    path.write_text(text, encoding="utf-8", newline="")
+    for source in [text, path, [path, text]]:
+        counts = count_text_chunks(source, pattern, num_workers=num_workers, block_size=1000)
+        n = 2 if isinstance(source, list) else 1
+        assert counts == Counter({chunk: n * count for chunk, count in expected.items()})
+
+def test_train_num_workers():
+    text = taylorswift()
+    tokenizer = RegexTokenizer()
+    tokenizer.train(text, 256 + 32)
+    parallel_tokenizer = RegexTokenizer()
+    parallel_tokenizer.train(text, 256 + 32, num_workers=2)
+    assert list(parallel_tokenizer.merges.items()) == list(tokenizer.merges.items())
+
+@pytest.mark.parametrize("block_size", [1, 5, 100])
+def test_iter_file_blocks(tmp_path, block_size):
+    path = tmp_path / "tricky.txt"
+    text = tricky_string * 5
+    path.write_text(text, encoding="utf-8", newline="")
+    blocks = list(iter_file_blocks(path, block_size))
+    assert "".join(blocks) == text
+    chunks = [chunk for block in blocks for chunk in re.findall(GPT4_SPLIT_PATTERN, block)]
+    assert chunks == re.findall(GPT4_SPLIT_PATTERN, text)
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_count_text_chunks_sources(tmp_path, num_workers):
+    text = taylorswift()
+    expected = count_text_chunks(text, GPT4_SPLIT_PATTERN)
+    path = tmp_path / "taylorswift.txt"
+    path.write_text(text, encoding="utf-8", newline="")
+    # a path, read in small blocks
+    counts = count_text_chunks(path, GPT4_SPLIT_PATTERN, num_workers=num_workers, block_size=1000)
+    assert list(counts.items()) == list(expected.items())
+    # a list of paths, the same file twice
+    counts = count_text_chunks([path, path], GPT4_SPLIT_PATTERN, num_workers=num_workers, block_size=1000)
+    assert counts == Counter({chunk: 2 * n for chunk, n in expected.items()})
+    # a generator of documents
+    documents = (line for line in text.splitlines(keepends=True))
+    expected = Counter(chunk for line in text.splitlines(keepends=True) for chunk in re.findall(GPT4_SPLIT_PATTERN, line))
+    counts = count_text_chunks(documents, GPT4_SPLIT_PATTERN, num_workers=num_workers, block_size=1000)
+    assert list(counts.items()) == list(expected.items())
+
+def test_train_from_path(tmp_path):
+    text = taylorswift()
+    path = tmp_path / "taylorswift.txt"
+    path.write_text(text, encoding="utf-8", newline="")
+    tokenizer = RegexTokenizer()
+    tokenizer.train(text, 256 + 32)
+    path_tokenizer = RegexTokenizer()
+    path_tokenizer.train(path, 256 + 32)
+    assert list(path_tokenizer.merges.items()) == list(tokenizer.merges.items())
+    with pytest.raises(TypeError):
+        RegexTokenizer().train([path, 42], 256 + 32)
+
+def test_find_last_boundary():
+    assert find_last_boundary("ab cd ef") == 5 # right after "cd"
+    assert find_last_boundary("ab!! ") == 0
+    special = re.compile(re.escape("<|x y|>"))
+    # never inside a special token, or where one may be starting
+    assert find_last_boundary("ab <|x y|> cd", special, 7) == 3
+    assert find_last_boundary("ab <|x y|> cd ef", special, 7) == 10
+    # the last 6 characters might be the start of a special token, still to come
+    assert find_last_boundary("ab cd <|x", special, 7) == 2
+    # searching from a start on
+    assert find_last_boundary("ab cd ef gh", start=3) == 8
+    assert find_last_boundary("ab cd ef gh", start=9) == 0
+
+def test_split_text():
+    text = taylorswift()[:20000]
+    slices = split_text(text, 1000)
+    assert "".join(slices) == text and len(slices) > 10
+    assert all(len(s) <= 1000 for s in slices)
+    tokenizer = RegexTokenizer()
+    assert [idx for s in slices for idx in tokenizer.encode(s)] == tokenizer.encode(text)
+    # no safe place to cut: the slice gets longer
+    assert split_text("ab" + "!" * 50 + " cd ef", 10) == ["ab" + "!" * 50 + " cd", " ef"]
+    assert split_text("!" * 50, 10) == ["!" * 50]
+    assert split_text("", 10) == []
+    # never through a special token
+    special = re.compile(re.escape("<|x y|>"))
+    assert split_text("ab cd<|x y|> ef gh", 8, special, 7) == ["ab cd", "<|x y|>", " ef gh"]
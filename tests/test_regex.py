@@ -0,0 +1,268 @@
+import os
+import sys
+import pickle
+import random
+import asyncio
+import subprocess
+from array import array
+import pytest
+
+from minbpe import RegexTokenizer
+from minbpe.regex import GPT2_SPLIT_PATTERN
+from .conftest import taylorswift, special_tokens, make_tokenizer
+
+# -----------------------------------------------------------------------------
+# tests
+
+def test_chunk_cache(trained_tokenizer):
+    text = taylorswift()
+    tokenizer = make_tokenizer(trained_tokenizer, cache_size=100)
+    assert tokenizer.encode(text) == trained_tokenizer.encode(text)
+    info = tokenizer.cache_info()
+    assert info.maxsize == 100 and info.currsize == 100
+    # the chunks that are a single token never get to the cache
+    chunks = tokenizer.compiled_pattern.findall(text)
+    multi_token = [chunk for chunk in chunks if chunk not in tokenizer._token_index]
+    assert info.hits + info.misses == len(multi_token)
+    assert info.hits > 0 and info.misses > 0
+    # the cache is emptied when the merges change
+    tokenizer.train("aaabdaaabac", 256 + 3)
+    assert tokenizer.cache_info() == (0, 0, 100, 0)
+    assert tokenizer.encode("aaabdaaabac") == [258, 100, 258, 97, 99]
+
+def test_token_index(trained_tokenizer):
+    tokenizer = make_tokenizer(trained_tokenizer)
+    text = taylorswift()
+    chunks = tokenizer.compiled_pattern.findall(text)
+    assert tokenizer.encode(text) == trained_tokenizer.encode(text)
+    # every chunk in the index encodes to its token, the long way too
+    index = tokenizer._token_index
+    assert sum(chunk in index for chunk in chunks) > len(chunks) / 2
+    for chunk, idx in index.items():
+        assert tokenizer._encode_chunk(chunk.encode("utf-8")) == [idx]
+    # and every single-token chunk is in it
+    for idx, token in tokenizer.vocab.items():
+        if tokenizer._encode_chunk(token) == [idx] and token.isascii():
+            assert index[token.decode("utf-8")] == idx
+    # the index is rebuilt when the merges change
+    tokenizer.train("aaabdaaabac", 256 + 3)
+    assert tokenizer._token_index is None
+    assert tokenizer.encode("aaabdaaabac") == [258, 100, 258, 97, 99]
+
+def test_chunk_cache_disabled(trained_tokenizer):
+    assert trained_tokenizer.cache is None
+    assert trained_tokenizer.cache_info() == (0, 0, 0, 0)
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+@pytest.mark.parametrize("cache_size", [0, 100])
+def test_encode_decode_batch(trained_tokenizer, backend, cache_size):
+    tokenizer = make_tokenizer(trained_tokenizer, cache_size=cache_size)
+    lines = taylorswift().splitlines()[:200] + ["<|endoftext|>hello world<|endofprompt|>"]
+    batch_ids = tokenizer.encode_batch(lines, num_workers=2, backend=backend, allowed_special="all")
+    assert batch_ids == [tokenizer.encode(line, allowed_special="all") for line in lines]
+    assert tokenizer.decode_batch(batch_ids, num_workers=2, backend=backend) == lines
+
+def test_encode_batch_serial(trained_tokenizer):
+    assert trained_tokenizer.encode_batch([], num_workers=4) == []
+    assert trained_tokenizer.encode_batch(["hello", " world"], num_workers=1) == [
+        trained_tokenizer.encode("hello"), trained_tokenizer.encode(" world")]
+    with pytest.raises(ValueError):
+        trained_tokenizer.encode_batch(["hello", " world"], num_workers=2, backend="gpu")
+
+def test_lazy_imports():
+    # the regex tokenizer doesn't need any of the gpt4 machinery, or tiktoken
+    code = ("import sys; from minbpe import RegexTokenizer; RegexTokenizer(); "
+            "assert 'minbpe.gpt4' not in sys.modules and 'tiktoken' not in sys.modules")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+
+def test_compiled_pattern_shared():
+    assert RegexTokenizer().compiled_pattern is RegexTokenizer().compiled_pattern
+    tokenizer = RegexTokenizer(pattern=GPT2_SPLIT_PATTERN)
+    assert tokenizer.compiled_pattern.pattern == GPT2_SPLIT_PATTERN
+    assert tokenizer.compiled_pattern is not RegexTokenizer().compiled_pattern
+
+def test_decode_invalid_ids(trained_tokenizer):
+    assert trained_tokenizer.decode([]) == ""
+    assert trained_tokenizer.decode(iter([104, 105])) == "hi"
+    assert trained_tokenizer.decode([100257]) == "<|endoftext|>"
+    for ids in [[104, 512], [104, -1], [100261], [10**9]]:
+        with pytest.raises(ValueError):
+            trained_tokenizer.decode(ids)
+
+@pytest.mark.parametrize("block_size", [1, 10, 1000, 1 << 16])
+def test_encode_stream(trained_tokenizer, block_size):
+    text = taylorswift()[:20000]
+    expected = trained_tokenizer.encode(text)
+    batches = list(trained_tokenizer.encode_stream(text, block_size=block_size))
+    assert [idx for batch in batches for idx in batch] == expected
+    if block_size < 1000:
+        assert len(batches) > 1
+
+def test_encode_stream_no_cuts(trained_tokenizer):
+    # long runs without a safe place to cut, e.g. base64 or CJK
+    rng = random.Random(1337)
+    text = "".join(rng.choice("abcXYZ0189+/=") for _ in range(50000)) + " 안녕하세요" * 2000 + " the end"
+    batches = list(trained_tokenizer.encode_stream(text, block_size=100))
+    assert [idx for batch in batches for idx in batch] == trained_tokenizer.encode(text)
+
+def test_encode_stream_custom_pattern():
+    # with a pattern that joins letters with the whitespace after them, the text
+    # can't be cut at all, so it is encoded at once
+    text = taylorswift()
+    tokenizer = RegexTokenizer(pattern=r"[^\n]+|\n")
+    tokenizer.train(text, 256 + 64)
+    batches = list(tokenizer.encode_stream(text, block_size=1000))
+    assert [idx for batch in batches for idx in batch] == tokenizer.encode(text)
+
+def test_encode_stream_sources(trained_tokenizer, tmp_path):
+    text = taylorswift()[:20000] + " 안녕하세요 👋🏽\r\n"
+    expected = trained_tokenizer.encode(text)
+    path = tmp_path / "text.txt"
+    path.write_text(text, encoding="utf-8", newline="")
+    # a file in text mode, and in binary mode (multi-byte characters get split up)
+    for mode, kwargs in [("r", dict(encoding="utf-8", newline="")), ("rb", {})]:
+        with open(path, mode, **kwargs) as f:
+            ids = [idx for batch in trained_tokenizer.encode_stream(f, block_size=333) for idx in batch]
+        assert ids == expected
+    # an iterator of pieces of random sizes
+    rng = random.Random(1337)
+    cuts = sorted(rng.sample(range(len(text)), 200))
+    pieces = (text[i:j] for i, j in zip([0] + cuts, cuts + [len(text)]))
+    ids = [idx for batch in trained_tokenizer.encode_stream(pieces, block_size=100) for idx in batch]
+    assert ids == expected
+    with pytest.raises(TypeError):
+        list(trained_tokenizer.encode_stream([text, b"bytes"]))
+
+@pytest.mark.parametrize("allowed_special", ["all", "none", {"<|endoftext|>"}])
+def test_encode_stream_special_tokens(trained_tokenizer, allowed_special):
+    words = taylorswift()[:3000].split(" ")
+    rng = random.Random(42)
+    for i in range(0, len(words), 20):
+        words[i] += rng.choice(list(special_tokens))
+    text = " ".join(words)
+    expected = trained_tokenizer.encode(text, allowed_special=allowed_special)
+    # pieces of 1..6 characters, so the special tokens get split across pieces
+    pieces, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, 6)
+        pieces.append(text[i:i + n])
+        i += n
+    for block_size in [1, 16, 500]:
+        batches = trained_tokenizer.encode_stream(iter(pieces), allowed_special=allowed_special, block_size=block_size)
+        assert [idx for batch in batches for idx in batch] == expected
+    # by default, a special token in the text raises, even if it arrives in pieces
+    with pytest.raises(AssertionError):
+        list(trained_tokenizer.encode_stream(["hello <|endof", "text|> world"], block_size=1))
+
+@pytest.mark.parametrize("allowed_special", ["all", "none", {"<|endoftext|>"}])
+def test_aencode(trained_tokenizer, allowed_special):
+    words = taylorswift()[:20000].split(" ")
+    for i in range(0, len(words), 50):
+        words[i] += "<|endoftext|><|endofprompt|>"
+    text = " ".join(words)
+    expected = trained_tokenizer.encode(text, allowed_special=allowed_special)
+    tokenizer = make_tokenizer(trained_tokenizer)
+    async def main():
+        ids = await tokenizer.aencode(text, allowed_special=allowed_special, slice_size=500)
+        batch_ids = await tokenizer.aencode_batch(["", text, "hello world"], allowed_special=allowed_special)
+        return ids, batch_ids, await tokenizer.adecode(ids)
+    ids, batch_ids, decoded = asyncio.run(main())
+    assert ids == expected and decoded == text
+    assert batch_ids == [[], expected, tokenizer.encode("hello world")]
+    tokenizer.close()
+    assert tokenizer._executor is None
+
+def test_aencode_no_cuts(trained_tokenizer):
+    # long runs without a safe place to cut: the slices get longer
+    rng = random.Random(1337)
+    text = "".join(rng.choice("abcXYZ0189+/=") for _ in range(20000)) + " the end " * 100
+    tokenizer = make_tokenizer(trained_tokenizer)
+    assert asyncio.run(tokenizer.aencode(text, slice_size=100)) == trained_tokenizer.encode(text)
+    tokenizer.close()
+
+def test_aencode_custom_pattern():
+    # a pattern that joins letters with the whitespace after them: the text
+    # can't be cut into slices, and is encoded at once
+    text = taylorswift()
+    tokenizer = RegexTokenizer(pattern=r"[^\n]+|\n")
+    tokenizer.train(text, 256 + 64)
+    assert asyncio.run(tokenizer.aencode(text, slice_size=1000)) == tokenizer.encode(text)
+    tokenizer.close()
+
+def test_aencode_concurrent(trained_tokenizer):
+    tokenizer = make_tokenizer(trained_tokenizer, cache_size=100)
+    text = taylorswift()
+    async def ticker(done):
+        ticks = 0
+        while not done.is_set():
+            await asyncio.sleep(0)
+            ticks += 1
+        return ticks
+    async def main():
+        # the event loop keeps running other tasks while the text is encoded
+        done = asyncio.Event()
+        ticks = asyncio.create_task(ticker(done))
+        ids = await asyncio.gather(*(tokenizer.aencode(text, slice_size=2000) for _ in range(4)))
+        done.set()
+        return ids, await ticks
+    ids, ticks = asyncio.run(main())
+    assert ids == [trained_tokenizer.encode(text)] * 4 and ticks > 0
+    # special tokens raise, like in encode
+    with pytest.raises(AssertionError):
+        asyncio.run(tokenizer.aencode("hello <|endoftext|> world", slice_size=3))
+    # the executor is not pickled along with the tokenizer
+    copy = pickle.loads(pickle.dumps(tokenizer))
+    assert copy._executor is None and copy.encode(text[:1000]) == tokenizer.encode(text[:1000])
+    tokenizer.close()
+
+def test_encode_array(trained_tokenizer):
+    text = taylorswift()[:5000] + "<|endoftext|>"
+    expected = trained_tokenizer.encode(text, allowed_special="all")
+    # the special token ids don't fit in 16 bits
+    assert trained_tokenizer.token_typecode() == "I"
+    ids = trained_tokenizer.encode_array(text, allowed_special="all")
+    assert ids.typecode == "I" and ids.tolist() == expected
+    tokenizer = RegexTokenizer()
+    tokenizer.merges, tokenizer.vocab = trained_tokenizer.merges, trained_tokenizer.vocab
+    assert tokenizer.token_typecode() == "H"
+    assert tokenizer.encode_array(text).tolist() == tokenizer.encode(text)
+    # the array is filled chunk by chunk, also through the cache
+    cached = make_tokenizer(trained_tokenizer, cache_size=100)
+    assert cached.encode_array(text + text, allowed_special="all").tolist() == expected + expected
+
+def test_encode_numpy(trained_tokenizer):
+    np = pytest.importorskip("numpy")
+    text = taylorswift()[:5000]
+    ids = trained_tokenizer.encode_numpy(text)
+    assert ids.dtype == np.uint32 and ids.tolist() == trained_tokenizer.encode(text)
+    assert trained_tokenizer.encode_numpy(text, dtype=np.uint16).dtype == np.uint16
+
+def test_encode_into(trained_tokenizer):
+    np = pytest.importorskip("numpy")
+    text = taylorswift()[:5000]
+    expected = trained_tokenizer.encode(text)
+    for out in [np.zeros(len(expected) + 10, dtype=np.uint16), array("I", [0] * (len(expected) + 10))]:
+        n = trained_tokenizer.encode_into(text, out)
+        assert n == len(expected) and list(out[:n]) == expected and list(out[n:]) == [0] * 10
+    with pytest.raises(ValueError):
+        trained_tokenizer.encode_into(text, np.zeros(10, dtype=np.uint16))
+    with pytest.raises(ValueError):
+        trained_tokenizer.encode_into(text, np.zeros(len(expected), dtype=np.float32))
+
+def test_special_matcher_cached(trained_tokenizer):
+    tokenizer = make_tokenizer(trained_tokenizer)
+    matcher = tokenizer._special_matcher({"<|endoftext|>"})
+    assert tokenizer._special_matcher(frozenset({"<|endoftext|>"})) is matcher
+    assert tokenizer._special_matcher("none") == ({}, None)
+    with pytest.raises(ValueError):
+        tokenizer._special_matcher(["<|endoftext|>"])
+    # new special tokens make for new matchers
+    tokenizer.register_special_tokens({"<|im_start|>": 600, "<|im_end|>": 601})
+    assert tokenizer._special_matcher({"<|endoftext|>"}) == ({}, None)
+    chat = "<|im_start|>user\nhello<|im_end|><|im_start|><|im_end|>\n"
+    assert tokenizer.encode(chat, allowed_special="all") == (
+        [600] + tokenizer.encode("user\nhello") + [601, 600, 601] + tokenizer.encode("\n"))
+    assert tokenizer.encode(chat, allowed_special="none") == tokenizer.encode_ordinary(chat)
+    with pytest.raises(AssertionError):
+        tokenizer.encode(chat)
@@ -0,0 +1,121 @@
+import os
+import json
+from array import array
+import pytest
+
+from minbpe import RegexTokenizer
+from minbpe import shards
+from minbpe.shards import encode_corpus, load_tokenizer
+from minbpe.__main__ import main
+from .conftest import taylorswift
+
+# -----------------------------------------------------------------------------
+# common test data
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    # a trained model, a text file and a JSONL file, and the tokens they should
+    # encode to (with <|endoftext|> after every document)
+    tmp_path = tmp_path_factory.mktemp("corpus")
+    tokenizer = RegexTokenizer()
+    text = taylorswift()
+    tokenizer.train(text, 256 + 64)
+    tokenizer.register_special_tokens({"<|endoftext|>": 256 + 64})
+    tokenizer.save(str(tmp_path / "tok"))
+    text_path = tmp_path / "taylorswift.txt"
+    text_path.write_text(text, encoding="utf-8", newline="")
+    documents = text.split("\n\n")[:100] + ["a <|endoftext|> in the text is just text"]
+    jsonl_path = tmp_path / "docs.jsonl"
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for document in documents:
+            f.write(json.dumps({"text": document}) + "\n")
+    eot = tokenizer.special_tokens["<|endoftext|>"]
+    expected = []
+    for document in [text] + documents:
+        expected += tokenizer.encode_ordinary(document) + [eot]
+    return dict(model=str(tmp_path / "tok.model"), inputs=[str(text_path), str(jsonl_path)], expected=expected)
+
+def read_shards(output_dir):
+    with open(os.path.join(output_dir, "index.json"), encoding="utf-8") as f:
+        index = json.load(f)
+    tokens = []
+    for shard in index["shards"]:
+        ids = array("H")
+        with open(os.path.join(output_dir, shard["file"]), "rb") as f:
+            ids.frombytes(f.read())
+        assert len(ids) == shard["num_tokens"]
+        tokens.append(ids.tolist())
+    return index, tokens
+
+# -----------------------------------------------------------------------------
+# tests
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_encode_corpus(tmp_path, corpus, num_workers):
+    index = encode_corpus(corpus["model"], corpus["inputs"], tmp_path, shard_size=5000, num_workers=num_workers,
+                          append_special="<|endoftext|>", block_size=1000, verbose=False)
+    assert index["done"] and index["dtype"] == "uint16"
+    _, tokens = read_shards(tmp_path)
+    assert [idx for shard in tokens for idx in shard] == corpus["expected"]
+    assert all(len(shard) == 5000 for shard in tokens[:-1]) and 0 < len(tokens[-1]) <= 5000
+    # running again is a no-op
+    assert encode_corpus(corpus["model"], corpus["inputs"], tmp_path, shard_size=5000, num_workers=num_workers,
+                         append_special="<|endoftext|>", block_size=1000, verbose=False) == index
+
+def test_encode_corpus_resume(tmp_path, corpus, monkeypatch):
+    kwargs = dict(shard_size=3000, num_workers=1, append_special="<|endoftext|>", block_size=700, verbose=False)
+    encode_corpus(corpus["model"], corpus["inputs"], tmp_path / "full", **kwargs)
+    index, tokens = read_shards(tmp_path / "full")
+    # interrupt a run after every few shards, and resume it until it's done
+    write_shard = shards._write_shard
+    for stop_after in [3, 2, 5]:
+        written = []
+        def interrupted_write_shard(path, ids):
+            if len(written) == stop_after:
+                raise KeyboardInterrupt
+            written.append(path)
+            write_shard(path, ids)
+        monkeypatch.setattr(shards, "_write_shard", interrupted_write_shard)
+        with pytest.raises(KeyboardInterrupt):
+            encode_corpus(corpus["model"], corpus["inputs"], tmp_path / "resumed", **kwargs)
+    monkeypatch.setattr(shards, "_write_shard", write_shard)
+    encode_corpus(corpus["model"], corpus["inputs"], tmp_path / "resumed", **kwargs)
+    resumed_index, resumed_tokens = read_shards(tmp_path / "resumed")
+    assert resumed_tokens == tokens
+    assert resumed_index["shards"] == index["shards"]
+    # different settings can't continue the same output
+    with pytest.raises(ValueError):
+        encode_corpus(corpus["model"], corpus["inputs"], tmp_path / "resumed", **dict(kwargs, shard_size=100))
+
+def test_cli(tmp_path, corpus):
+    main(["encode", corpus["model"], *corpus["inputs"], "-o", str(tmp_path), "--shard-size", "1000000",
+          "--num-workers", "1", "--append-special", "<|endoftext|>", "--quiet"])
+    _, tokens = read_shards(tmp_path)
+    assert tokens == [corpus["expected"]]
+
+def test_load_tokenizer(tmp_path, corpus):
+    assert isinstance(load_tokenizer(corpus["model"]), RegexTokenizer)
+    from minbpe import BasicTokenizer
+    tokenizer = BasicTokenizer()
+    tokenizer.train("hello hello world", 256 + 3)
+    tokenizer.save(str(tmp_path / "basic"))
+    loaded = load_tokenizer(str(tmp_path / "basic.model"))
+    assert isinstance(loaded, BasicTokenizer) and loaded.merges == tokenizer.merges
+
+@pytest.mark.parametrize("kind", ["basic", "custom_pattern"])
+def test_encode_corpus_not_cut(tmp_path, corpus, kind):
+    # a BasicTokenizer, and a split pattern that joins words with the space after
+    # them: text files can't be cut into blocks, and are encoded whole
+    from minbpe import BasicTokenizer
+    tokenizer = BasicTokenizer() if kind == "basic" else RegexTokenizer(r"\w+ ?|[^\w ]+| +")
+    tokenizer.train(taylorswift()[:5000], 256 + 32)
+    tokenizer.save(str(tmp_path / "tok"))
+    index = encode_corpus(str(tmp_path / "tok.model"), corpus["inputs"], tmp_path / "out", shard_size=3000,
+                          num_workers=1, block_size=1000, verbose=False)
+    _, tokens = read_shards(tmp_path / "out")
+    with open(corpus["inputs"][1], encoding="utf-8") as f:
+        documents = [taylorswift()] + [json.loads(line)["text"] for line in f]
+    assert [idx for shard in tokens for idx in shard] == [idx for doc in documents for idx in tokenizer.encode(doc)]
+    # the last (partial) shard was saved at the end of the input, so resuming
+    # from it doesn't write its tokens again
+    assert len(tokens) > 1 and index["done"] and index["position"] == [2, 0, 0]
@@ -0,0 +1,68 @@
+import json
+import pytest
+import regex as re
+
+from minbpe import BasicTokenizer, RegexTokenizer
+from .conftest import taylorswift, make_tokenizer
+
+# -----------------------------------------------------------------------------
+# tests
+
+def test_stats_disabled(trained_tokenizer):
+    assert trained_tokenizer.stats is None
+
+def test_encode_stats(trained_tokenizer):
+    tokenizer = make_tokenizer(trained_tokenizer, cache_size=100)
+    text = taylorswift()[:5000]
+    calls = []
+    stats = tokenizer.enable_stats(callback=calls.append)
+    ids = tokenizer.encode(text + "<|endoftext|>" + text, allowed_special="all")
+    assert ids == trained_tokenizer.encode(text + "<|endoftext|>" + text, allowed_special="all")
+    chunks = re.findall(tokenizer.pattern, text)
+    info = stats.as_dict()
+    assert info["calls"] == {"encode": 1}
+    counters = info["counters"]["encode"]
+    assert counters["chunks"] == 2 * len(chunks)
+    assert counters["bytes"] == 2 * len(text.encode("utf-8"))
+    assert counters["tokens"] == len(ids) - 1 # all but the special token
+    assert counters["merges"] == counters["bytes"] - counters["tokens"]
+    # every chunk is either a single token, or goes through the cache
+    assert counters["index_hits"] > counters["cache_hits"] > 0
+    assert counters["index_hits"] + counters["cache_hits"] + counters["cache_misses"] == counters["chunks"]
+    assert info["longest_chunk"] == max(len(chunk.encode("utf-8")) for chunk in chunks)
+    assert sum(info["histograms"]["chunk_bytes"].values()) == counters["chunks"]
+    assert set(info["seconds"]) == {"encode", "special_split", "regex_split", "merge"}
+    json.dumps(info)
+    # the callback sees every call on its own
+    assert len(calls) == 1 and calls[0]["op"] == "encode" and calls[0]["chunks"] == 2 * len(chunks)
+    # encode_array, encode_ordinary and decode count as one call each
+    tokenizer.encode_array(text)
+    tokenizer.encode_ordinary(text)
+    tokenizer.decode(ids)
+    info = stats.as_dict()
+    assert info["calls"] == {"encode": 3, "decode": 1}
+    assert info["counters"]["decode"] == {"bytes": len((text + "<|endoftext|>" + text).encode("utf-8")), "tokens": len(ids)}
+    assert sum(info["histograms"]["latency_us"].values()) == 4
+    stats.reset()
+    assert stats.as_dict()["calls"] == {}
+    tokenizer.disable_stats()
+    tokenizer.encode(text)
+    assert stats.as_dict()["calls"] == {} and len(calls) == 4
+
+def test_basic_stats():
+    tokenizer = BasicTokenizer()
+    tokenizer.train(taylorswift()[:2000], 256 + 16)
+    stats = tokenizer.enable_stats()
+    ids = tokenizer.encode("hello world")
+    counters = stats.as_dict()["counters"]["encode"]
+    assert counters["chunks"] == 1 and counters["tokens"] == len(ids)
+    assert counters["merges"] == len("hello world") - len(ids)
+
+def test_stats_batch(trained_tokenizer):
+    # the stats stay behind when the tokenizer is sent to worker processes
+    tokenizer = make_tokenizer(trained_tokenizer)
+    stats = tokenizer.enable_stats(callback=lambda call: None)
+    lines = taylorswift().splitlines()[:50]
+    assert tokenizer.encode_batch(lines, num_workers=2, backend="process") == [trained_tokenizer.encode(line) for line in lines]
+    tokenizer.encode_batch(lines, num_workers=2, backend="thread")
+    assert stats.as_dict()["calls"] == {"encode": len(lines)}
@@ -0,0 +1,185 @@
+import random
+import pytest
+
+import regex as re
+from minbpe import BasicTokenizer, RegexTokenizer
+from minbpe import checkpoint
+from minbpe.base import get_stats, merge
+from minbpe.regex import GPT4_SPLIT_PATTERN
+from minbpe.training import ChunkStore, train_merges
+from .conftest import taylorswift
+
+# -----------------------------------------------------------------------------
+# common test data
+
+def reference_merges(text, num_merges):
+    # the straightforward training loop, recounting everything on every merge
+    ids = [list(ch.encode("utf-8")) for ch in re.findall(GPT4_SPLIT_PATTERN, text)]
+    merges = {}
+    for i in range(num_merges):
+        stats = {}
+        for chunk_ids in ids:
+            get_stats(chunk_ids, stats)
+        if not stats:
+            break
+        pair = max(stats, key=stats.get)
+        ids = [merge(chunk_ids, pair, 256 + i) for chunk_ids in ids]
+        merges[pair] = 256 + i
+    return merges
+
+# -----------------------------------------------------------------------------
+# tests
+
+@pytest.mark.parametrize("text, num_merges", [
+    ("aaabdaaabac", 3),
+    ("aaaaaaaa bbbb aaaa", 10), # overlapping runs of the same byte
+    ("hello world!!!? (안녕하세요!) lol123 😉", 20), # ties and multi-byte chars
+    ("FILE", 40),
+])
+def test_train_merges_matches_reference(text, num_merges):
+    if text == "FILE":
+        text = taylorswift()
+    ids = [list(ch.encode("utf-8")) for ch in re.findall(GPT4_SPLIT_PATTERN, text)]
+    merges, vocab = train_merges(ids, num_merges)
+    expected = reference_merges(text, num_merges)
+    # the merges are the same, and in the same order
+    assert list(merges.items()) == list(expected.items())
+    for (p0, p1), idx in merges.items():
+        assert vocab[idx] == vocab[p0] + vocab[p1]
+
+def test_train_merges_stops_early():
+    # only 3 distinct pairs exist, so we can't possibly do 10 merges
+    merges, vocab = train_merges([[1, 2, 3], [1, 2]], 10)
+    assert merges == {(1, 2): 256, (256, 3): 257}
+    assert len(vocab) == 258
+
+def test_train_merges_counts():
+    # weighting each distinct chunk by its count is the same as repeating it
+    text = taylorswift()
+    chunks = re.findall(GPT4_SPLIT_PATTERN, text)
+    ids = [list(ch.encode("utf-8")) for ch in chunks]
+    merges, _ = train_merges(ids, 100)
+    chunk_counts = {}
+    for ch in chunks:
+        chunk_counts[ch] = chunk_counts.get(ch, 0) + 1
+    unique_ids = [list(ch.encode("utf-8")) for ch in chunk_counts]
+    unique_merges, _ = train_merges(unique_ids, 100, counts=list(chunk_counts.values()))
+    assert list(unique_merges.items()) == list(merges.items())
+
+def test_chunk_store():
+    chunks = [list(ch.encode("utf-8")) for ch in re.findall(GPT4_SPLIT_PATTERN, taylorswift())]
+    store = ChunkStore.from_chunks(bytes(chunk) for chunk in chunks)
+    assert len(store) == len(chunks) and list(map(list, store)) == chunks
+    store[1] = [300]
+    store[2] = []
+    assert list(store[0]) == chunks[0] and list(store[1]) == [300] and list(store[2]) == []
+    assert list(store[3]) == chunks[3]
+    # training over it gives the same merges as over a list of lists
+    store = ChunkStore.from_chunks(bytes(chunk) for chunk in chunks)
+    merges, _ = train_merges(store, 50)
+    assert list(merges.items()) == list(train_merges(chunks, 50)[0].items())
+    assert list(map(list, store)) == chunks
+
+def test_regex_tokenizer_train():
+    text = taylorswift()
+    tokenizer = RegexTokenizer()
+    tokenizer.train(text, 256 + 40)
+    assert tokenizer.merges == reference_merges(text, 40)
+    assert tokenizer.decode(tokenizer.encode(text)) == text
+
+def test_checkpoint_roundtrip(tmp_path):
+    ids = [[256, 97], [98], [], [257, 258, 99]]
+    merges = {(97, 97): 256, (98, 98): 257, (256, 257): 258}
+    path = tmp_path / "state.ckpt"
+    checkpoint.write_checkpoint(path, GPT4_SPLIT_PATTERN, merges, ids, [3, 1, 2, 10**12])
+    state = checkpoint.read_checkpoint(path)
+    assert state["pattern"] == GPT4_SPLIT_PATTERN
+    assert state["merges"] == merges and state["vocab"][258] == b"aabb"
+    assert list(map(list, state["ids"])) == ids and state["counts"] == [3, 1, 2, 10**12]
+
+@pytest.mark.parametrize("TokenizerClass", [BasicTokenizer, RegexTokenizer])
+def test_resume_training(tmp_path, monkeypatch, TokenizerClass):
+    text = taylorswift()[:10000] if TokenizerClass is BasicTokenizer else taylorswift()
+    full = TokenizerClass()
+    full.train(text, 256 + 60)
+    # grow the vocab of a finished run
+    path = tmp_path / "state.ckpt"
+    tokenizer = TokenizerClass()
+    tokenizer.train(text, 256 + 25, checkpoint=path)
+    grown = TokenizerClass()
+    grown.resume_training(path, 256 + 60)
+    assert list(grown.merges.items()) == list(full.merges.items())
+    assert grown.vocab == full.vocab and grown.pattern == full.pattern
+    # resume a run that got interrupted after its third checkpoint
+    path = tmp_path / "interrupted.ckpt"
+    write_checkpoint = checkpoint.write_checkpoint
+    written = []
+    def interrupted_write_checkpoint(*args):
+        if len(written) == 3:
+            raise KeyboardInterrupt
+        written.append(args)
+        write_checkpoint(*args)
+    monkeypatch.setattr(checkpoint, "write_checkpoint", interrupted_write_checkpoint)
+    with pytest.raises(KeyboardInterrupt):
+        TokenizerClass().train(text, 256 + 60, checkpoint=path, checkpoint_every=7)
+    monkeypatch.setattr(checkpoint, "write_checkpoint", write_checkpoint)
+    assert len(checkpoint.read_checkpoint(path)["merges"]) == 21
+    resumed = TokenizerClass()
+    resumed.resume_training(path, 256 + 60)
+    assert list(resumed.merges.items()) == list(full.merges.items())
+    with pytest.raises(ValueError):
+        TokenizerClass().resume_training(path, 256 + 30) # smaller than the checkpoint
+
+def test_resume_training_wrong_tokenizer(tmp_path):
+    path = tmp_path / "state.ckpt"
+    RegexTokenizer().train("hello world, hello there", 256 + 5, checkpoint=path)
+    with pytest.raises(ValueError):
+        BasicTokenizer().resume_training(path, 256 + 10)
+
+def test_vectorized_merge():
+    np = pytest.importorskip("numpy")
+    from minbpe import vectorized
+    rng = random.Random(1337)
+    for _ in range(500):
+        # lots of runs of the same token, which is where merges overlap
+        ids = [rng.choice([1, 2, 3]) for _ in range(rng.randint(0, 30))]
+        pair = (rng.choice([1, 2]), rng.choice([1, 2]))
+        out = vectorized.merge(np.array(ids, dtype=np.int32), pair, 9)
+        assert out.tolist() == merge(ids, pair, 9)
+        if len(ids) >= 2:
+            stats = get_stats(ids)
+            best = max(stats, key=stats.get)
+            assert vectorized.most_common_pair(np.array(ids, dtype=np.int32), 4) == (best, stats[best])
+
+@pytest.mark.parametrize("text, vocab_size", [
+    ("aaabdaaabac", 256 + 3),
+    ("aaaaaaaaaaa bbbb aaaaaaa", 256 + 8),
+    ("hello world!!!? (안녕하세요!) lol123 😉", 256 + 20),
+    ("FILE", 256 + 100),
+])
+@pytest.mark.parametrize("bincount", [True, False])
+def test_numpy_backend(monkeypatch, text, vocab_size, bincount):
+    pytest.importorskip("numpy")
+    from minbpe import vectorized
+    if not bincount:
+        monkeypatch.setattr(vectorized, "BINCOUNT_MAX_PAIRS", 0) # count by sorting instead
+    text = taylorswift()[:20000] if text == "FILE" else text
+    tokenizer = BasicTokenizer()
+    tokenizer.train(text, vocab_size)
+    numpy_tokenizer = BasicTokenizer()
+    numpy_tokenizer.train(text, vocab_size, backend="numpy")
+    assert list(numpy_tokenizer.merges.items()) == list(tokenizer.merges.items())
+    assert numpy_tokenizer.vocab == tokenizer.vocab
+
+def test_numpy_backend_checkpoint(tmp_path):
+    pytest.importorskip("numpy")
+    text = taylorswift()[:10000]
+    tokenizer = BasicTokenizer()
+    tokenizer.train(text, 256 + 40)
+    path = tmp_path / "state.ckpt"
+    BasicTokenizer().train(text, 256 + 20, checkpoint=path, backend="numpy")
+    resumed = BasicTokenizer()
+    resumed.resume_training(path, 256 + 40, backend="numpy")
+    assert list(resumed.merges.items()) == list(tokenizer.merges.items())
+    with pytest.raises(ValueError):
+        BasicTokenizer().train(text, 256 + 10, backend="gpu")
@@ -5,20 +5,24 @@ The whole thing runs in ~25 seconds on my laptop.
 
 import os
 import time
+from pathlib import Path
 from minbpe import BasicTokenizer, RegexTokenizer
 
 # open some text and train a vocab of 512 tokens
-text = open("tests/taylorswift.txt", "r", encoding="utf-8").read()
+# the BasicTokenizer needs the whole text in memory, while the RegexTokenizer
+# can also stream it straight from the file (or a list of files)
+path = Path("tests/taylorswift.txt")
+text = path.read_text(encoding="utf-8")
 
 # create a directory for models, so we don't pollute the current directory
 os.makedirs("models", exist_ok=True)
 
 t0 = time.time()
-for TokenizerClass, name in zip([BasicTokenizer, RegexTokenizer], ["basic", "regex"]):
+for TokenizerClass, name, source in zip([BasicTokenizer, RegexTokenizer], ["basic", "regex"], [text, path]):
 
     # construct the Tokenizer object and kick off verbose training
     tokenizer = TokenizerClass()
-    tokenizer.train(text, 512, verbose=True)
+    tokenizer.train(source, 512, verbose=True)
     # writes two files in the models directory: name.model, and name.vocab
     prefix = os.path.join("models", name)
     tokenizer.save(prefix)